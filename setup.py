@@ -1,10 +1,10 @@
+from typing import List
+
 from setuptools import find_packages, setup
 
 VERSION = "1.0.0"
 
-REQUIRED = [
-    "typing-extensions",
-]
+REQUIRED: List[str] = []
 
 
 def long_description() -> str:
@@ -20,7 +20,7 @@ setup(
     long_description=long_description(),
     long_description_content_type="text/markdown",
     author_email="zulip-devel@googlegroups.com",
-    python_requires=">=3.5",
+    python_requires=">=3.8",
     url="https://github.com/zulip/zulint",
     packages=find_packages(exclude=("tests",)),
     package_data={
@@ -36,7 +36,7 @@ setup(
         "License :: OSI Approved :: Apache Software License",
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
-        "Programming Language :: Python :: 3.6",
+        "Programming Language :: Python :: 3.8",
         "Programming Language :: Python :: Implementation :: CPython",
         "Programming Language :: Python :: Implementation :: PyPy",
     ],
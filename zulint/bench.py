@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, cast
+
+from zulint import lister
+from zulint.custom_rules import Rule, RuleList
+
+# Bump this whenever benchmarks change in a way that makes their
+# results incomparable with those of earlier versions.
+BENCH_VERSION = 1
+
+# Each timing sample runs a benchmark for at least this many seconds.
+MIN_SAMPLE_TIME = 0.2
+
+# Every lint run, even for --list, starts by importing zulint.command,
+# so keep it from creeping up as heavy modules get imported eagerly.
+IMPORT_MODULE = "zulint.command"
+IMPORT_BUDGET = 0.08
+
+LANGS = ["py", "js", "html", "css", "md"]
+
+# Rules like those that real projects define, with exclusions,
+# include_only restrictions and exclude_line entries.
+BENCH_RULES: Dict[str, List[Rule]] = {
+    "py": [
+        {"pattern": r"[\t ]+$", "description": "Fix trailing whitespace"},
+        {"pattern": r"^#+[^#!\s]", "description": "Missing space after # in comment"},
+        {
+            "pattern": r"print\(",
+            "description": "Use logging instead of print",
+            "exclude": {"tools/", "scripts/"},
+        },
+        {
+            "pattern": r"\.(get|filter)\(.*\.(id|pk)\b",
+            "description": "Avoid querying by primary key in a loop",
+            "include_only": {"models/", "views/"},
+        },
+        {
+            "pattern": r"except:",
+            "description": "Catch a specific exception",
+            "exclude_line": {("lib/module0/file0.py", "except:")},
+        },
+        {"pattern": r"TODO\(\w+\)", "description": "Link TODOs to an issue"},
+        {"pattern": r"\bassertEquals\(", "description": "Use assertEqual"},
+        {"pattern": r"\s+$", "description": "Fix trailing whitespace"},
+    ],
+    "js": [
+        {"pattern": r"[\t ]+$", "description": "Fix trailing whitespace"},
+        {"pattern": r"console\.log", "description": "Remove debugging output"},
+        {"pattern": r"\bvar\s", "description": "Use const or let"},
+        {"pattern": r"==[^=]", "description": "Use === instead of =="},
+        {
+            "pattern": r"i18n\.t\(\"[^\"]*\"\s*\+",
+            "description": "Do not concatenate translated strings",
+        },
+    ],
+    "html": [
+        {"pattern": r"[\t ]+$", "description": "Fix trailing whitespace"},
+        {"pattern": r"style=\"", "description": "Avoid inline styles"},
+        {
+            "pattern": r"<a [^>]*target=\"_blank\"(?![^>]*rel=)",
+            "description": "Add rel",
+        },
+        {"pattern": r"title=\"[a-z]", "description": "Capitalize titles"},
+    ],
+    "css": [
+        {"pattern": r"[\t ]+$", "description": "Fix trailing whitespace"},
+        {"pattern": r"!important", "description": "Avoid !important"},
+        {"pattern": r"#[0-9a-fA-F]{3,6}\b", "description": "Use a color variable"},
+    ],
+    "md": [
+        {"pattern": r"[\t ]+$", "description": "Fix trailing whitespace"},
+        {"pattern": r"\bwww\.", "description": "Use https:// links"},
+        {"pattern": r"\bJavascript\b", "description": "Spell it JavaScript"},
+    ],
+}
+
+# Lines of synthetic source code, a few of which violate the rules.
+SAMPLE_LINES: Dict[str, List[str]] = {
+    "py": [
+        "import os",
+        "def handler(request, user_profile):",
+        "    result = compute_result(request.GET, user_profile.realm)",
+        "    # Look up the stream before checking permissions.",
+        "    stream = Stream.objects.get(id=stream_id)",
+        "    for message in messages:",
+        "        rows.append({'id': message.id, 'content': message.content})",
+        "    return json_success(request, data={'result': result})",
+        "class UserProfileTest(ZulipTestCase):",
+        "    self.assertEqual(response.status_code, 200)",
+        "    print(value)  ",
+        "    except:",
+    ],
+    "js": [
+        'import $ from "jquery";',
+        "export function render_message(message, opts) {",
+        '    const $row = $("<div>").addClass("message_row");',
+        '    if (message.type === "stream") {',
+        '        $row.attr("data-stream-id", message.stream_id);',
+        "    }",
+        "    return $row;",
+        "}",
+        "    var count = 0;",
+        "    console.log(message);",
+    ],
+    "html": [
+        '<div class="settings-section" data-name="profile">',
+        '    <h3>{{t "Profile" }}</h3>',
+        '    <label for="full_name">{{t "Name" }}</label>',
+        '    <input id="full_name" type="text" value="{{full_name}}" />',
+        "</div>",
+        '<span style="color: red">  ',
+    ],
+    "css": [
+        ".message_row {",
+        "    display: flex;",
+        "    padding: 2px 0;",
+        "    color: var(--color-text-default);",
+        "}",
+        "    color: #fff !important;",
+    ],
+    "md": [
+        "# Setting up the development environment",
+        "",
+        "Follow the steps below to run the server locally.",
+        "See [the guide](https://zulip.readthedocs.io/) for details.",
+        "Visit www.example.com for Javascript docs.  ",
+    ],
+}
+
+SHEBANGS = ["#!/usr/bin/env python3", "#!/bin/sh", "#!/usr/bin/env node"]
+DIRECTORIES = ["lib", "models", "views", "tools", "static", "docs"]
+# One in this many files is an extensionless script.
+SCRIPT_INTERVAL = 20
+
+
+class BenchResult(NamedTuple):
+    name: str
+    seconds: float
+    files: int
+    bytes: int
+    peak_memory: int
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds
+
+    @property
+    def mb_per_second(self) -> float:
+        return self.bytes / self.seconds / 1e6
+
+    def as_dict(self) -> Dict[str, object]:
+        return {
+            "seconds": self.seconds,
+            "files_per_second": self.files_per_second,
+            "mb_per_second": self.mb_per_second,
+            "peak_memory": self.peak_memory,
+        }
+
+
+def generate_repo(
+    root: str, files: int, lines_per_file: int, violation_rate: float, seed: int = 0
+) -> None:
+    """Creates a git repository of synthetic source files in root.
+
+    The same arguments always produce the same files, so that results
+    are comparable across runs.  About violation_rate of the lines
+    violate a rule, and some files are extensionless scripts whose type
+    comes from their shebang line.
+    """
+    rng = random.Random(seed)
+    subprocess.check_call(["git", "init", "-q", root])
+    for i in range(files):
+        lang = LANGS[i % len(LANGS)]
+        directory = os.path.join(DIRECTORIES[i % len(DIRECTORIES)], f"module{i // 100}")
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+        good_lines = SAMPLE_LINES[lang][:-2]
+        bad_lines = SAMPLE_LINES[lang][-2:]
+        lines = [
+            rng.choice(bad_lines)
+            if rng.random() < violation_rate
+            else rng.choice(good_lines)
+            for _ in range(lines_per_file)
+        ]
+        if i % SCRIPT_INTERVAL == SCRIPT_INTERVAL - 1:
+            fn = f"script{i}"
+            lines.insert(0, SHEBANGS[i % len(SHEBANGS)])
+        else:
+            fn = f"file{i}.{lang}"
+        with open(os.path.join(root, directory, fn), "w", encoding="utf8") as f:
+            f.writelines(line + "\n" for line in lines)
+    subprocess.check_call(["git", "add", "--all"], cwd=root)
+
+
+@contextlib.contextmanager
+def working_directory(path: str) -> Iterator[None]:
+    old_cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(old_cwd)
+
+
+def run_benchmark(
+    name: str,
+    setup: Callable[[], Callable[[], object]],
+    files: int,
+    size: int,
+    repeat: int,
+) -> BenchResult:
+    """Times the function that setup returns, taking the best of repeat
+    samples, and measures its peak memory allocation in one more run.
+
+    Fast functions are run several times per sample, with a fresh setup
+    (which isn't timed) before each run, to keep timer noise out of the
+    results.  Memory is traced in a separate run, since tracing slows
+    everything down.
+    """
+
+    def run() -> float:
+        func = setup()
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    number = max(1, math.ceil(MIN_SAMPLE_TIME / max(run(), 1e-9)))
+    best = min(sum(run() for _ in range(number)) / number for _ in range(repeat))
+
+    func = setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return BenchResult(name, best, files, size, peak_memory)
+
+
+def make_rule_lists(mmap_threshold: Optional[int] = None) -> List[RuleList]:
+    return [
+        RuleList(langs=[lang], rules=rules, mmap_threshold=mmap_threshold)
+        for lang, rules in BENCH_RULES.items()
+    ]
+
+
+def run_benchmarks(root: str, repeat: int) -> List[BenchResult]:
+    with working_directory(root):
+        by_lang = lister.list_files(group_by_ftype=True)
+        paths = [path for lang_paths in by_lang.values() for path in lang_paths]
+        size = sum(os.path.getsize(path) for path in paths)
+        lang_paths = [path for lang in LANGS for path in by_lang.get(lang, [])]
+        lang_size = sum(os.path.getsize(path) for path in lang_paths)
+
+        def list_files() -> Callable[[], object]:
+            # Start from the cold cache of a new process.
+            lister.shebang_lines.clear()
+            return lambda: lister.list_files(group_by_ftype=True)
+
+        def get_ftype() -> Callable[[], object]:
+            return lambda: [lister.get_ftype(path, True) for path in paths]
+
+        def get_rules_applying_to_fn() -> Callable[[], object]:
+            rule_lists = make_rule_lists()
+            return lambda: [
+                rule_list.get_rules_applying_to_fn(path, rule_list.rules)
+                for rule_list in rule_lists
+                for path in by_lang.get(rule_list.langs[0], [])
+            ]
+
+        def check(mmap_threshold: Optional[int] = None) -> Callable[[], object]:
+            rule_lists = make_rule_lists(mmap_threshold)
+
+            def func() -> None:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+                    devnull
+                ):
+                    for rule_list in rule_lists:
+                        rule_list.check(by_lang)
+
+            return func
+
+        return [
+            run_benchmark("list_files", list_files, len(paths), size, repeat),
+            run_benchmark("get_ftype", get_ftype, len(paths), size, repeat),
+            run_benchmark(
+                "get_rules_applying_to_fn",
+                get_rules_applying_to_fn,
+                len(lang_paths),
+                lang_size,
+                repeat,
+            ),
+            run_benchmark("RuleList.check", check, len(lang_paths), lang_size, repeat),
+            run_benchmark(
+                "RuleList.check (mmap)",
+                lambda: check(mmap_threshold=0),
+                len(lang_paths),
+                lang_size,
+                repeat,
+            ),
+        ]
+
+
+def time_import(module: str, repeat: int) -> float:
+    """Returns the best time, over repeat new interpreters, that importing
+    module took according to -X importtime.
+
+    Bytecode is cached in a temporary directory by a first run, which
+    isn't counted, as it is for an installed package.
+    """
+    with tempfile.TemporaryDirectory(prefix="zulint-") as pycache_prefix:
+        env = {**os.environ, "PYTHONPYCACHEPREFIX": pycache_prefix}
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        times = []
+        for _ in range(repeat + 1):
+            output = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                env=env,
+                stderr=subprocess.PIPE,
+                check=True,
+            ).stderr.decode("utf-8")
+            # Lines look like "import time: self [us] | cumulative | name".
+            for line in output.splitlines():
+                fields = line.split("|")
+                if fields[-1].strip() == module:
+                    times.append(int(fields[-2]) / 1e6)
+        return min(times[1:])
+
+
+def get_zulint_revision() -> Optional[str]:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "describe", "--always", "--dirty"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stderr=subprocess.DEVNULL,
+            )
+            .decode("utf-8")
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(
+    results: Sequence[BenchResult],
+    baseline: Optional[Dict[str, object]] = None,
+    threshold: float = 0.1,
+) -> List[str]:
+    """Prints a table of results, compared to the baseline if given, and
+    returns the names of benchmarks that got more than threshold
+    slower."""
+    baseline_results: Dict[str, Dict[str, float]] = {}
+    if baseline is not None:
+        baseline_results = cast(Dict[str, Dict[str, float]], baseline["results"])
+    regressions = []
+    print(
+        "{:<26} {:>10} {:>12} {:>9} {:>11}{}".format(
+            "benchmark",
+            "seconds",
+            "files/s",
+            "MB/s",
+            "peak mem",
+            "  change" if baseline is not None else "",
+        )
+    )
+    for result in results:
+        change = ""
+        old = baseline_results.get(result.name)
+        if old is not None:
+            ratio = result.seconds / old["seconds"]
+            change = f"  {ratio - 1:+.1%}"
+            if ratio > 1 + threshold:
+                regressions.append(result.name)
+                change += " (slower)"
+        print(
+            "{:<26} {:>10.4f} {:>12.0f} {:>9.2f} {:>9.1f}MB{}".format(
+                result.name,
+                result.seconds,
+                result.files_per_second,
+                result.mb_per_second,
+                result.peak_memory / 1e6,
+                change,
+            )
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark zulint's file lister and rule engine on a "
+        "synthetic repository"
+    )
+    parser.add_argument(
+        "--files", type=int, default=2000, help="number of files to generate"
+    )
+    parser.add_argument(
+        "--lines", type=int, default=200, help="number of lines in each file"
+    )
+    parser.add_argument(
+        "--violation-rate",
+        type=float,
+        default=0.01,
+        help="fraction of lines that violate a rule",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="runs of each benchmark to take the best of",
+    )
+    parser.add_argument(
+        "--repo", metavar="DIR", help="use or create the synthetic repository in DIR"
+    )
+    parser.add_argument("--json", metavar="FILE", help="save the results to FILE")
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        help="compare with results saved by --json, and fail if any benchmark "
+        "got slower",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="fraction by which a benchmark may get slower before --compare "
+        "fails (default: 0.1)",
+    )
+    parser.add_argument(
+        "--import-budget",
+        type=float,
+        default=IMPORT_BUDGET,
+        metavar="SECONDS",
+        help=f"fail if importing {IMPORT_MODULE} takes longer than this "
+        f"(default: {IMPORT_BUDGET})",
+    )
+    args = parser.parse_args()
+
+    params = {
+        "version": BENCH_VERSION,
+        "files": args.files,
+        "lines": args.lines,
+        "violation_rate": args.violation_rate,
+        "seed": args.seed,
+    }
+    baseline: Optional[Dict[str, object]] = None
+    if args.compare is not None:
+        with open(args.compare, encoding="utf8") as f:
+            baseline = json.load(f)
+        assert baseline is not None
+        if baseline["params"] != params:
+            parser.error(f"{args.compare} was run with different parameters")
+
+    with contextlib.ExitStack() as stack:
+        if args.repo is None:
+            root = stack.enter_context(tempfile.TemporaryDirectory(prefix="zulint-"))
+        else:
+            root = args.repo
+        if not os.path.exists(os.path.join(root, ".git")):
+            generate_repo(root, args.files, args.lines, args.violation_rate, args.seed)
+        results = run_benchmarks(root, args.repeat)
+    import_seconds = time_import(IMPORT_MODULE, args.repeat)
+
+    regressions = print_results(results, baseline, args.threshold)
+    print(
+        "{:<26} {:>10.4f}  (budget {})".format(
+            f"import {IMPORT_MODULE}", import_seconds, args.import_budget
+        )
+    )
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf8") as f:
+            json.dump(
+                {
+                    "params": params,
+                    "zulint": get_zulint_revision(),
+                    "python": platform.python_version(),
+                    "results": {result.name: result.as_dict() for result in results},
+                    "import_seconds": import_seconds,
+                },
+                f,
+                indent=2,
+            )
+    if regressions:
+        print("Slower than {}: {}".format(args.compare, ", ".join(regressions)))
+    if import_seconds > args.import_budget:
+        print(f"Importing {IMPORT_MODULE} took longer than {args.import_budget}s")
+    if regressions or import_seconds > args.import_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from zulint import lister
+
+# Bump this whenever the format or meaning of cached results changes.
+CACHE_VERSION = 1
+
+# Scanning the whole cache to prune it is only worth doing this often,
+# in seconds.
+PRUNE_INTERVAL = 60 * 60
+
+
+class ResultCache:
+    """An on-disk cache of linter results, keyed by file contents.
+
+    Entries are small JSON files stored under the repository's .git
+    directory, so they are never tracked or shown by `git status`.
+    Once the cache takes up more than max_size bytes of disk space,
+    prune() evicts the least recently used entries.
+
+    Files are identified by the blob SHAs in git's index where the
+    working tree matches it, unless trust_index is False, e.g. because
+    fixers may rewrite files during the run; then every file is hashed.
+    """
+
+    def __init__(
+        self,
+        directory: Optional[str] = None,
+        max_size: int = 64 * 1024 * 1024,
+        trust_index: bool = True,
+    ) -> None:
+        self._directory = directory
+        self.max_size = max_size
+        self.trust_index = trust_index
+        self.blob_shas: Optional[Dict[str, str]] = None
+
+    @property
+    def directory(self) -> str:
+        if self._directory is None:
+            self._directory = lister.get_git_path("zulint-cache")
+        return self._directory
+
+    def file_hash(self, path: str) -> str:
+        """Returns the git blob SHA of the working tree copy of path."""
+        if not self.trust_index:
+            return lister.hash_blob(path)
+        if self.blob_shas is None:
+            self.blob_shas = lister.get_blob_shas()
+        sha = self.blob_shas.get(path)
+        if sha is None:
+            sha = lister.hash_blob(path)
+        return sha
+
+    def key(self, *parts: object) -> str:
+        data = json.dumps([CACHE_VERSION, *parts], separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key: str) -> object:
+        path = self.path(key)
+        try:
+            with open(path, encoding="utf8") as f:
+                value = json.load(f)
+            # Record the access for least-recently-used eviction.
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return value
+
+    def set(self, key: str, value: object) -> None:
+        import tempfile
+
+        path = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write atomically, since linters run in parallel processes.
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf8", dir=os.path.dirname(path), delete=False
+            ) as f:
+                json.dump(value, f, separators=(",", ":"))
+            os.replace(f.name, path)
+        except OSError:
+            pass
+
+    def prune(self) -> None:
+        """Evicts the least recently used entries until the cache fits
+        in max_size bytes, at most once every PRUNE_INTERVAL seconds."""
+        import time
+
+        marker = os.path.join(self.directory, "pruned")
+        try:
+            if time.time() - os.stat(marker).st_mtime < PRUNE_INTERVAL:
+                return
+        except OSError:
+            pass
+        try:
+            with open(marker, "w"):
+                pass
+        except OSError:
+            return
+
+        entries: List[Tuple[float, int, str]] = []
+        total_size = 0
+        for subdir in os.scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                stat = entry.stat()
+                # Most entries are far smaller than a filesystem block,
+                # so count the space they take up rather than their size.
+                size = getattr(stat, "st_blocks", 0) * 512 or stat.st_size
+                entries.append((stat.st_mtime, size, entry.path))
+                total_size += size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
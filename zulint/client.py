@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# This is started for every lint run, so it avoids importing anything
+# that it doesn't need, like the rest of zulint.
+
+import array
+import json
+import os
+import socket
+import sys
+from typing import List, Optional
+
+SOCKET_NAME = "zulint.sock"
+
+
+def find_git_dir() -> Optional[str]:
+    """Finds the .git directory of the current directory without
+    running git, which would cost as much as the rest of the client."""
+    directory = os.getcwd()
+    while True:
+        dot_git = os.path.join(directory, ".git")
+        if os.path.isdir(dot_git):
+            return dot_git
+        if os.path.isfile(dot_git):
+            # A worktree or submodule, whose .git file points elsewhere.
+            with open(dot_git, encoding="utf8") as f:
+                line = f.readline().strip()
+            if line.startswith("gitdir: "):
+                return os.path.join(directory, line[len("gitdir: ") :])
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+
+
+def standard_fds() -> List[int]:
+    fds = []
+    for fd in range(3):
+        try:
+            os.fstat(fd)
+        except OSError:
+            fd = os.open(os.devnull, os.O_RDWR)  # noqa: PLW2901
+        fds.append(fd)
+    return fds
+
+
+def main() -> None:
+    args = sys.argv[1:]
+    socket_path = None
+    if args and args[0].startswith("--socket="):
+        socket_path = args.pop(0)[len("--socket=") :]
+    if socket_path is None:
+        git_dir = find_git_dir()
+        if git_dir is None:
+            sys.exit("zulint: not in a git repository")
+        socket_path = os.path.join(git_dir, SOCKET_NAME)
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sys.exit(
+            f"zulint: no daemon is listening on {socket_path}; "
+            "start one with python -m zulint.daemon <lint script>"
+        )
+
+    request = json.dumps(
+        {"argv": args, "cwd": os.getcwd(), "env": dict(os.environ)}
+    ).encode("utf-8")
+    request += b"\n"
+    sent = sock.sendmsg(
+        [request],
+        [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", standard_fds()))],
+    )
+    sock.sendall(request[sent:])
+
+    # The run writes straight to our stdout and stderr; all that comes
+    # back here is its exit code, once it's done.  Exiting early, e.g.
+    # on ^C, closes the connection, and the daemon stops the run.
+    response = b""
+    try:
+        while True:
+            chunk = sock.recv(64)
+            if not chunk:
+                break
+            response += chunk
+    except KeyboardInterrupt:
+        sys.exit(130)
+    sys.exit(int(response) if response.strip().isdigit() else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,67 @@
 import argparse
+import contextlib
+import json
 import logging
-import multiprocessing
+import math
+import os
+import signal
+import subprocess
 import sys
 import time
 import weakref
-from typing import Callable, Dict, List, Mapping, NoReturn, Sequence, Set, Tuple, Union
+from collections import defaultdict
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Mapping,
+    NoReturn,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
+
+from zulint import lister, results
+from zulint.cache import ResultCache
+from zulint.linters import (
+    run_command_async,
+    run_command_batches,
+    split_targets,
+    terminate_process_groups,
+)
+from zulint.printer import BLUE, BOLDRED, ENDC, GREEN, colors, print_output, text_stream
 
-from zulint import lister
-from zulint.linters import run_command
-from zulint.printer import BLUE, BOLDRED, ENDC, GREEN, colors
+# asyncio and multiprocessing take longer to import than the rest of
+# zulint together, and aren't needed for e.g. --list, so they're
+# imported where they're used.
+if TYPE_CHECKING:
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
 
 
 def add_default_linter_arguments(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
         "--modified", "-m", action="store_true", help="Only check modified files"
     )
+    parser.add_argument(
+        "--since",
+        metavar="REF",
+        help="Only check files changed since the merge base of REF and HEAD, "
+        "including uncommitted and untracked files",
+    )
+    parser.add_argument(
+        "--changed-lines",
+        action="store_true",
+        help="Only report custom rule violations on lines changed since the "
+        "--since REF, or since HEAD",
+    )
     parser.add_argument(
         "--verbose-timing",
         "-vt",
@@ -61,6 +108,43 @@ def add_default_linter_arguments(parser: argparse.ArgumentParser) -> None:
         "--fix", action="store_true", help="Automatically fix problems where supported"
     )
     parser.add_argument("--jobs", "-j", type=int, help="Limit number of parallel jobs")
+    parser.add_argument(
+        "--fail-fast",
+        action="store_true",
+        help="Stop as soon as a linter fails, terminating those still running",
+    )
+    parser.add_argument(
+        "--profile-rules",
+        nargs="?",
+        type=int,
+        const=10,
+        metavar="N",
+        help="Time each custom rule and file, and print the N slowest (default 10)",
+    )
+    parser.add_argument(
+        "--format",
+        choices=results.FORMATS,
+        default="text",
+        help="Also write findings and timings as JSON lines, SARIF or "
+        "GitHub Actions annotations",
+    )
+    parser.add_argument(
+        "--output",
+        metavar="FILE",
+        help="Write --format results to FILE instead of stdout, which then "
+        "keeps the usual output",
+    )
+    parser.add_argument(
+        "--group-output",
+        action="store_true",
+        help="Print each linter's output in one block once it finishes, "
+        "rather than as it arrives",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Check every file, ignoring results cached by previous runs",
+    )
 
 
 def split_arg_into_list(arg: str) -> List[str]:
@@ -72,9 +156,10 @@ run_parallel_functions: "weakref.WeakValueDictionary[int, Callable[[], int]]" =
 )
 
 
-def run_parallel_worker(item: Tuple[str, int]) -> Tuple[str, int]:
+def run_parallel_worker(item: Tuple[str, int]) -> Tuple[str, int, float]:
     name, func_id = item
     func = run_parallel_functions[func_id]
+    results.set_current_linter(name)
     logging.info("start %s", name)
     time_start = time.perf_counter()
     result = func()
@@ -82,39 +167,265 @@ def run_parallel_worker(item: Tuple[str, int]) -> Tuple[str, int]:
     logging.info("finish %s; elapsed time: %g", name, time_end - time_start)
     sys.stdout.flush()
     sys.stderr.flush()
-    return name, result
+    return name, result, time_end - time_start
+
+
+def terminate_lint_worker(signum: int, frame: object) -> None:
+    terminate_process_groups()
+    os._exit(128 + signum)
+
+
+def init_lint_worker() -> None:
+    # Take this worker's commands down with it when it's terminated,
+    # e.g. by --fail-fast; they run in process groups of their own.
+    signal.signal(signal.SIGTERM, terminate_lint_worker)
+
+
+def terminate_workers(executor: "ProcessPoolExecutor") -> None:
+    # ProcessPoolExecutor has no public way to stop tasks that have
+    # already started.
+    for process in list(getattr(executor, "_processes", {}).values()):
+        process.terminate()
+
+
+def next_linter(
+    pending: Sequence[str],
+    running: AbstractSet[str],
+    finished: AbstractSet[str],
+    expected_durations: Mapping[str, float],
+    depends_on: Mapping[str, AbstractSet[str]],
+    conflicts_with: Mapping[str, AbstractSet[str]],
+) -> Optional[str]:
+    """Picks the pending linter that is expected to take longest, among
+    those whose dependencies have finished and which don't conflict with
+    a running linter.  Linters without a recorded duration go first, in
+    the order they were registered."""
+    ready = [
+        name
+        for name in pending
+        if depends_on.get(name, set()) <= finished
+        and not conflicts_with.get(name, set()) & running
+    ]
+    if not ready:
+        return None
+    return max(ready, key=lambda name: expected_durations.get(name, math.inf))
 
 
 def run_parallel(
-    lint_functions: Mapping[str, Callable[[], int]], jobs: int
+    lint_functions: Mapping[str, Callable[[], int]],
+    jobs: Optional[int],
+    expected_durations: Mapping[str, float] = {},
+    depends_on: Mapping[str, AbstractSet[str]] = {},
+    conflicts_with: Mapping[str, AbstractSet[str]] = {},
+    durations: Optional[Dict[str, float]] = None,
+    async_lint_functions: Mapping[str, Callable[[], Awaitable[int]]] = {},
+    fail_fast: bool = False,
+    cancelled: Optional[Set[str]] = None,
 ) -> Set[str]:
+    """Runs the lint functions, jobs at a time, longest first according
+    to expected_durations.  A linter only starts once the linters it
+    depends_on have finished, and never alongside one it conflicts_with.
+    The time each linter took is stored in durations, if given.
+
+    Linters with an entry in async_lint_functions run as coroutines in
+    this process; the others run in worker processes if possible, or
+    else in threads.
+
+    With fail_fast, the first failure stops the run: linters that are
+    running are terminated, along with the commands they started, and
+    the rest are skipped.  Their names are added to cancelled, if given.
+    """
     # Smuggle the functions through a global variable to work around
     # multiprocessing's inability to pickle closures.
     for func in lint_functions.values():
         run_parallel_functions[id(func)] = func
 
+    import asyncio
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    slots = jobs or os.cpu_count() or 1
+    sync_linters = [name for name in lint_functions if name not in async_lint_functions]
+    with contextlib.ExitStack() as stack:
+        executor = None
+        if slots > 1 and sync_linters and multiprocessing.get_start_method() == "fork":
+            # Unlike multiprocessing.Pool's daemonic workers, these workers
+            # may start processes of their own, e.g. RuleList.check.
+            executor = stack.enter_context(
+                ProcessPoolExecutor(
+                    min(slots, len(sync_linters)), initializer=init_lint_worker
+                )
+            )
+            # With fork, the first task starts every worker; do that
+            # before asyncio starts threads, which fork doesn't copy.
+            executor.submit(int).result()
+
+        return asyncio.run(
+            run_scheduled(
+                lint_functions,
+                async_lint_functions,
+                executor,
+                slots,
+                expected_durations if slots > 1 else {},
+                depends_on,
+                conflicts_with if slots > 1 else {},
+                durations,
+                fail_fast,
+                cancelled if cancelled is not None else set(),
+            )
+        )
+
+
+async def run_scheduled(
+    lint_functions: Mapping[str, Callable[[], int]],
+    async_lint_functions: Mapping[str, Callable[[], Awaitable[int]]],
+    executor: Optional["ProcessPoolExecutor"],
+    slots: int,
+    expected_durations: Mapping[str, float],
+    depends_on: Mapping[str, AbstractSet[str]],
+    conflicts_with: Mapping[str, AbstractSet[str]],
+    durations: Optional[Dict[str, float]],
+    fail_fast: bool,
+    cancelled: Set[str],
+) -> Set[str]:
+    import asyncio
+
+    async def run_linter(name: str) -> Tuple[str, int, float]:
+        if name not in async_lint_functions:
+            func_id = id(lint_functions[name])
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, run_parallel_worker, (name, func_id)
+            )
+        logging.info("start %s", name)
+        time_start = time.perf_counter()
+        result = await async_lint_functions[name]()
+        time_end = time.perf_counter()
+        logging.info("finish %s; elapsed time: %g", name, time_end - time_start)
+        return name, result, time_end - time_start
+
+    # Dependencies on linters that aren't running (e.g. due to --skip)
+    # are already satisfied.
+    depends_on = {
+        name: depends_on.get(name, set()) & lint_functions.keys()
+        for name in lint_functions
+    }
+    pending = list(lint_functions)
+    finished: Set[str] = set()
     failed_linters = set()
-    args = ((name, id(func)) for name, func in lint_functions.items())
-    if jobs != 1 and multiprocessing.get_start_method() == "fork":
-        with multiprocessing.Pool(jobs) as pool:
-            for name, result in pool.imap_unordered(run_parallel_worker, args):
+    running: Dict["asyncio.Future[Tuple[str, int, float]]", str] = {}
+    try:
+        while pending or running:
+            while len(running) < slots:
+                name = next_linter(
+                    pending,
+                    set(running.values()),
+                    finished,
+                    expected_durations,
+                    depends_on,
+                    conflicts_with,
+                )
+                if name is None:
+                    break
+                pending.remove(name)
+                running[asyncio.ensure_future(run_linter(name))] = name
+            assert running, f"Circular dependencies between linters: {pending}"
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                name, result, elapsed = future.result()
+                results.report_timing(name, elapsed, result)
+                finished.add(name)
+                if durations is not None:
+                    durations[name] = elapsed
                 if result != 0:
                     failed_linters.add(name)
-    else:
-        for name, result in map(run_parallel_worker, args):
-            if result != 0:
-                failed_linters.add(name)
+            if fail_fast and failed_linters and (pending or running):
+                cancelled.update(pending, running.values())
+                pending.clear()
+                await cancel_linters(running, executor)
+                running.clear()
+    except BaseException:
+        # On ^C, commands started from threads don't get the signal, since
+        # they have process groups of their own, and asyncio would wait
+        # for those threads to finish.
+        terminate_process_groups()
+        raise
     return failed_linters
 
 
+async def cancel_linters(
+    running: Iterable["asyncio.Future[Tuple[str, int, float]]"],
+    executor: Optional["ProcessPoolExecutor"],
+) -> None:
+    """Stops running linters: coroutines are cancelled, which terminates
+    their commands, worker processes are terminated along with their
+    commands, and so are the commands started from threads, which can't
+    themselves be stopped."""
+    import asyncio
+
+    running = list(running)
+    for future in running:
+        future.cancel()
+    if executor is not None:
+        terminate_workers(executor)
+    terminate_process_groups()
+    await asyncio.gather(*running, return_exceptions=True)
+
+
+def get_durations_path() -> str:
+    return lister.get_git_path("zulint-durations.json")
+
+
+def load_durations() -> Dict[str, float]:
+    """Returns how long each linter took the last time it ran."""
+    try:
+        with open(get_durations_path(), encoding="utf8") as f:
+            durations = json.load(f)
+    except (OSError, ValueError, subprocess.CalledProcessError):
+        return {}
+    if not isinstance(durations, dict):
+        return {}
+    return {
+        name: duration
+        for name, duration in durations.items()
+        if isinstance(duration, (int, float))
+    }
+
+
+def save_durations(durations: Mapping[str, float]) -> None:
+    import tempfile
+
+    try:
+        path = get_durations_path()
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf8", dir=os.path.dirname(path) or ".", delete=False
+        ) as f:
+            json.dump({**load_durations(), **durations}, f, indent=2, sort_keys=True)
+        os.replace(f.name, path)
+    except (OSError, subprocess.CalledProcessError):
+        pass
+
+
 class LinterConfig:
     def __init__(self, args: argparse.Namespace) -> None:
         self.args = args
         self.by_lang: Dict[str, List[str]] = {}
         self.groups: Mapping[str, Sequence[str]] = {}
         self.lint_functions: Dict[str, Callable[[], int]] = {}
+        # Coroutine versions of lint_functions, for external linters.
+        self.async_lint_functions: Dict[str, Callable[[], Awaitable[int]]] = {}
         self.lint_descriptions: Dict[str, str] = {}
         self.fixable_linters: Set[str] = set()
+        # The languages whose files each linter reads, or None for all.
+        self.linter_langs: Dict[str, Optional[Set[str]]] = {}
+        self.depends_on: Dict[str, Set[str]] = {}
+        self.conflicts_with: Dict[str, Set[str]] = {}
+        # With --fix, a fixer may rewrite files after they're listed, so
+        # the SHAs listed for them can't identify their contents.
+        self.cache: Optional[ResultCache] = (
+            None if args.no_cache else ResultCache(trust_index=not args.fix)
+        )
+        self.line_ranges: Optional[Dict[str, List[Tuple[int, int]]]] = None
 
     def list_files(
         self,
@@ -136,9 +447,18 @@ class LinterConfig:
                 *{ft for group in groups.values() for ft in group},
             ]
 
+        if self.args.list or self.args.list_groups:
+            # do_lint will only print the linters and exit, so don't
+            # spend time asking git for the files.
+            self.by_lang = defaultdict(list)
+            return self.by_lang
+
+        # Ask git for the index once, rather than for each listing.
+        lister.take_index_snapshot = True
         self.by_lang = lister.list_files(
             targets=self.args.targets,
             modified_only=self.args.modified,
+            since=self.args.since,
             ftypes=file_types,
             use_shebang=use_shebang,
             group_by_ftype=True,
@@ -146,12 +466,74 @@ class LinterConfig:
         )
         return self.by_lang
 
+    def changed_lines(self) -> Optional[Dict[str, List[Tuple[int, int]]]]:
+        """Returns the changed ranges of lines in each file, to pass as
+        RuleList.check's line_ranges, or None without --changed-lines."""
+        if self.args.changed_lines and self.line_ranges is None:
+            self.line_ranges = lister.get_changed_lines(
+                self.args.since, self.args.targets
+            )
+        return self.line_ranges
+
+    @overload
     def lint(self, func: Callable[[], int]) -> Callable[[], int]:
-        self.lint_functions[func.__name__] = func
-        self.lint_descriptions[func.__name__] = (
-            func.__doc__ if func.__doc__ else "External Linter"
-        )
-        return func
+        ...
+
+    @overload
+    def lint(
+        self,
+        *,
+        depends_on: Sequence[str] = [],
+        conflicts_with: Sequence[str] = [],
+    ) -> Callable[[Callable[[], int]], Callable[[], int]]:
+        ...
+
+    def lint(
+        self,
+        func: Optional[Callable[[], int]] = None,
+        *,
+        depends_on: Sequence[str] = [],
+        conflicts_with: Sequence[str] = [],
+    ) -> Union[Callable[[], int], Callable[[Callable[[], int]], Callable[[], int]]]:
+        """Registers a function as a linter; use either as @lint or as
+        @lint(depends_on=[...], conflicts_with=[...])."""
+
+        def register(func: Callable[[], int]) -> Callable[[], int]:
+            self.lint_functions[func.__name__] = func
+            self.lint_descriptions[func.__name__] = (
+                func.__doc__ if func.__doc__ else "External Linter"
+            )
+            self.linter_langs[func.__name__] = None
+            self.add_constraints(func.__name__, depends_on, conflicts_with)
+            return func
+
+        if func is None:
+            return register
+        return register(func)
+
+    def add_constraints(
+        self, name: str, depends_on: Sequence[str], conflicts_with: Sequence[str]
+    ) -> None:
+        self.depends_on[name] = set(depends_on)
+        for other in conflicts_with:
+            self.conflicts_with.setdefault(name, set()).add(other)
+            self.conflicts_with.setdefault(other, set()).add(name)
+
+    def get_conflicts(self) -> Dict[str, Set[str]]:
+        """Returns the linters that mustn't run at the same time as each
+        linter.  With --fix, that includes any linter reading the files
+        that a fixer may rewrite."""
+        conflicts = {name: set(others) for name, others in self.conflicts_with.items()}
+        if self.args.fix:
+            for fixer in self.fixable_linters:
+                fixer_langs = self.linter_langs.get(fixer)
+                for name, langs in self.linter_langs.items():
+                    if name != fixer and (
+                        fixer_langs is None or langs is None or fixer_langs & langs
+                    ):
+                        conflicts.setdefault(fixer, set()).add(name)
+                        conflicts.setdefault(name, set()).add(fixer)
+        return conflicts
 
     def external_linter(
         self,
@@ -163,6 +545,12 @@ class LinterConfig:
         description: str = "External Linter",
         check_arg: Union[str, Sequence[str]] = [],
         suppress_line: Callable[[str], bool] = lambda line: False,
+        cacheable: bool = False,
+        config_files: Sequence[str] = [],
+        depends_on: Sequence[str] = [],
+        conflicts_with: Sequence[str] = [],
+        shard: bool = False,
+        max_files_per_invocation: Optional[int] = None,
     ) -> None:
         """Registers an external linter program to be run as part of the
         linter.  This program will be passed the subset of files being
@@ -170,13 +558,30 @@ class LinterConfig:
         such files, exits without doing anything.
 
         If target_langs is empty, just runs the linter unconditionally.
+
+        If cacheable is True, the linter's results are cached by file
+        contents: files it passed cleanly before are not passed to it
+        again, and a failing run over unchanged files is replayed.  This
+        is only correct for linters that check each target file
+        independently; changes to any config_files invalidate the cache.
+        Linters without target_langs are never cached.
+
+        The linter only starts after the linters named in depends_on
+        have finished, and never runs alongside those in conflicts_with.
+
+        If shard is True, the targets are split into batches of similar
+        total size, which are checked by concurrent runs of the linter,
+        one per job.  Independently, max_files_per_invocation limits the
+        number of targets passed to a single run.
         """
         self.lint_descriptions[name] = description
         if fix_arg or check_arg:
             self.fixable_linters.add(name)
+        self.linter_langs[name] = set(target_langs) if target_langs else None
+        self.add_constraints(name, depends_on, conflicts_with)
         color = next(colors)
 
-        def run_linter() -> int:
+        async def run_linter() -> int:
             targets: List[str] = []
             if len(target_langs) != 0:
                 targets = [
@@ -194,11 +599,87 @@ class LinterConfig:
             full_command += [arg] if isinstance(arg, str) else arg
 
             if pass_targets:
-                full_command += targets
+                # Without target_langs there are no targets to cache by.
+                if (
+                    cacheable
+                    and targets
+                    and self.cache is not None
+                    and not self.args.fix
+                ):
+                    return await run_cached_linter(full_command, targets)
+                return await run_linter_on_targets(full_command, targets)
+
+            return await run_command_async(
+                name,
+                color,
+                full_command,
+                suppress_line,
+                grouped=self.args.group_output,
+            )
+
+        async def run_linter_on_targets(
+            full_command: List[str],
+            targets: List[str],
+            output: Optional[List[str]] = None,
+        ) -> int:
+            jobs = (self.args.jobs or os.cpu_count() or 1) if shard else 1
+            batches = split_targets(targets, jobs, max_files_per_invocation)
+            return await run_command_batches(
+                name,
+                color,
+                full_command,
+                batches,
+                jobs,
+                suppress_line,
+                output,
+                grouped=self.args.group_output,
+            )
 
-            return run_command(name, color, full_command, suppress_line)
+        async def run_cached_linter(full_command: List[str], targets: List[str]) -> int:
+            cache = self.cache
+            assert cache is not None
+            fingerprint = [
+                full_command,
+                [[fn, cache.file_hash(fn)] for fn in config_files],
+            ]
+            target_hashes = [[target, cache.file_hash(target)] for target in targets]
+
+            def clean_key(target_hash: List[str]) -> str:
+                return cache.key("clean", fingerprint, *target_hash)
 
-        self.lint_functions[name] = run_linter
+            # Only files that didn't pass cleanly last time need checking.
+            target_hashes = [
+                target_hash
+                for target_hash in target_hashes
+                if cache.get(clean_key(target_hash)) is None
+            ]
+            if len(target_hashes) == 0:
+                return 0
+            targets = [target for target, _ in target_hashes]
+
+            key = cache.key("run", fingerprint, target_hashes)
+            cached = cache.get(key)
+            if isinstance(cached, dict):
+                print_output(name, color, cached["output"])
+                returncode: int = cached["returncode"]
+                return returncode
+
+            output: List[str] = []
+            returncode = await run_linter_on_targets(full_command, targets, output)
+            if returncode == 0 and not output:
+                for target_hash in target_hashes:
+                    cache.set(clean_key(target_hash), True)
+            elif returncode >= 0:
+                cache.set(key, {"returncode": returncode, "output": output})
+            return returncode
+
+        def run_linter_sync() -> int:
+            import asyncio
+
+            return asyncio.run(run_linter())
+
+        self.lint_functions[name] = run_linter_sync
+        self.async_lint_functions[name] = run_linter
 
     def set_logger(self) -> None:
         logging.basicConfig(format="%(asctime)s %(message)s")
@@ -233,21 +714,47 @@ class LinterConfig:
                 )
             sys.exit()
         self.set_logger()
+        results.open_results(self.args.format, self.args.output)
 
-        jobs = self.args.jobs
-        if self.args.fix:
-            # Do not run multiple fixers in parallel, since they might
-            # race with each other and corrupt each other's output.
-            jobs = 1
-
-        failed_linters = run_parallel(self.lint_functions, jobs)
+        # With --fix, get_conflicts keeps fixers from running alongside
+        # anything else reading the same files, since they might race
+        # with each other and corrupt each other's output.
+        durations: Dict[str, float] = {}
+        cancelled: Set[str] = set()
+        failed_linters = run_parallel(
+            self.lint_functions,
+            self.args.jobs,
+            expected_durations=load_durations(),
+            depends_on=self.depends_on,
+            conflicts_with=self.get_conflicts(),
+            durations=durations,
+            async_lint_functions=self.async_lint_functions,
+            fail_fast=self.args.fail_fast,
+            cancelled=cancelled,
+        )
+        save_durations(durations)
+        if self.cache is not None:
+            self.cache.prune()
 
+        if cancelled:
+            print(
+                "{}Stopped after {} failed; cancelled: {}{}".format(
+                    BOLDRED,
+                    ", ".join(sorted(failed_linters)),
+                    ", ".join(sorted(cancelled)),
+                    ENDC,
+                ),
+                file=text_stream(),
+            )
         failed_fixable_linters = failed_linters & self.fixable_linters
         if failed_fixable_linters:
             print(
                 "Run {}{} --fix --only={}{} to autofix.".format(
                     BLUE, sys.argv[0], ",".join(sorted(failed_fixable_linters)), ENDC
                 ),
+                file=text_stream(),
             )
 
+        # Only now, since text_stream() is stdout once results are closed.
+        results.close_results()
         sys.exit(1 if failed_linters else 0)
@@ -1,10 +1,62 @@
 import bisect
+import collections
+import contextlib
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import mmap
+import operator
+import os
 import re
-from typing import AbstractSet, List, Mapping, Optional, Sequence, Tuple
+import signal
+import sys
+import threading
+import time
+import warnings
+from array import array
+from typing import (
+    TYPE_CHECKING,
+    AbstractSet,
+    AnyStr,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Match,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypedDict,
+    Union,
+    cast,
+)
 
-from typing_extensions import TypedDict
+from zulint import results
+from zulint.cache import ResultCache
+from zulint.printer import (
+    BLUE,
+    ENDC,
+    GREEN,
+    MAGENTA,
+    YELLOW,
+    colors,
+    print_err,
+    print_lines,
+    text_stream,
+)
 
-from zulint.printer import BLUE, ENDC, GREEN, MAGENTA, YELLOW, colors, print_err
+if TYPE_CHECKING:
+    import sre_parse
+
+# Below this many files, starting worker processes costs more than it saves.
+PARALLEL_MIN_FILES = 64
 
 
 class Rule(TypedDict, total=False):
@@ -15,9 +67,535 @@ class Rule(TypedDict, total=False):
     exclude_pattern: str
     good_lines: Sequence[str]
     include_only: AbstractSet[str]
+    max_errors: int
     pattern: str
 
 
+def parse_pattern(pattern: "re.Pattern[str]") -> "sre_parse.SubPattern":
+    with warnings.catch_warnings():
+        # sre_parse is a deprecated alias for re._parser since Python 3.11.
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import sre_parse
+
+    return sre_parse.parse(pattern.pattern, pattern.flags)
+
+
+def literal_chars(parsed: "sre_parse.SubPattern") -> Iterator[Optional[str]]:
+    """Yields, in order, the characters that every match of the parsed
+    pattern must contain, with None standing in for anything that isn't
+    a plain case-sensitive literal."""
+    for op, av in parsed.data:
+        if op.name == "LITERAL":
+            yield chr(cast(int, av))
+        elif op.name == "SUBPATTERN" and isinstance(av, tuple):
+            group, add_flags, del_flags, subpattern = av
+            if add_flags & re.IGNORECASE:
+                yield None
+            else:
+                yield from literal_chars(subpattern)
+        else:
+            yield None
+
+
+def required_literal(pattern: "re.Pattern[str]") -> Optional[str]:
+    """Returns the longest string that every match of the pattern must
+    contain, or None if there isn't an obvious one.
+
+    A file that doesn't contain this string can't match the pattern,
+    which lets us skip the much slower regular expression scan."""
+    if pattern.flags & re.IGNORECASE:
+        return None
+    runs = [""]
+    for c in literal_chars(parse_pattern(pattern)):
+        if c is None:
+            runs.append("")
+        else:
+            runs[-1] += c
+    return max(runs, key=len) or None
+
+
+def has_nested_quantifier(
+    parsed: "sre_parse.SubPattern", in_repeat: bool = False
+) -> bool:
+    """Returns whether the parsed pattern repeats something that can
+    itself match a varying number of times, like (a+)+ or (\\s*\\w+)*.
+    Backtracking out of a near-match of such a pattern can take time
+    exponential in the length of the line."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import sre_parse
+
+    for op, av in parsed.data:
+        if op.name in ("MAX_REPEAT", "MIN_REPEAT") and isinstance(av, tuple):
+            low, high, subpattern = av
+            varies = high > 1 and high != low
+            if varies and in_repeat:
+                return True
+            if has_nested_quantifier(
+                subpattern, in_repeat or (varies and high == sre_parse.MAXREPEAT)
+            ):
+                return True
+        elif op.name == "SUBPATTERN" and isinstance(av, tuple):
+            if has_nested_quantifier(av[3], in_repeat):
+                return True
+        elif op.name == "BRANCH" and isinstance(av, tuple):
+            if any(has_nested_quantifier(branch, in_repeat) for branch in av[1]):
+                return True
+        elif op.name in ("ASSERT", "ASSERT_NOT") and isinstance(av, tuple):
+            if has_nested_quantifier(av[1], in_repeat):
+                return True
+    return False
+
+
+class BacktrackingWarning(UserWarning):
+    """A rule's pattern may take exponential time to match."""
+
+
+class RuleTimeoutError(Exception):
+    pass
+
+
+def raise_rule_timeout(signum: int, frame: object) -> None:
+    raise RuleTimeoutError
+
+
+# Escapes, counted repetitions and case-insensitive flags: all but the
+# escapes for ASCII literals mean something different in a bytes
+# pattern, e.g. \w and \b only know about ASCII, and {m,n} counts bytes.
+BYTES_SENSITIVE_RE = re.compile(r"\\(.)|\{|\(\?[a-zA-Z-]*i", re.S)
+
+
+def compile_bytes_pattern(pattern: "re.Pattern[str]") -> Optional["re.Pattern[bytes]"]:
+    """Compiles pattern to match UTF-8 encoded bytes, or returns None if
+    it can't be relied on to match the same lines that way."""
+    if not pattern.pattern.isascii() or pattern.flags & re.IGNORECASE:
+        return None
+    for m in BYTES_SENSITIVE_RE.finditer(pattern.pattern):
+        escaped = m.group(1)
+        if escaped is None or (escaped.isalnum() and escaped not in "ntrfvaAZ"):
+            return None
+    try:
+        return re.compile(pattern.pattern.encode("ascii"), re.M)
+    except re.error:
+        # Flags like (?u) are only allowed in str patterns.
+        return None
+
+
+# Dots and negated classes, outside escapes: in a bytes pattern, they
+# match one byte of a multi-byte character rather than all of it.
+ONE_CHAR_RE = re.compile(r"\\.|(\.|\[\^)", re.S)
+NON_ASCII_RE = re.compile(rb"[\x80-\xff]")
+
+
+def needs_ascii_contents(pattern: "re.Pattern[bytes]") -> bool:
+    """Checks whether a pattern from compile_bytes_pattern can only be
+    relied on to match the same lines as the original in ASCII contents."""
+    return any(
+        m.group(1) is not None
+        for m in ONE_CHAR_RE.finditer(pattern.pattern.decode("ascii"))
+    )
+
+
+class CompiledRule:
+    """A Rule with its regular expressions compiled, and its exclude_line
+    entries indexed by file name, ahead of time."""
+
+    def __init__(self, rule: Rule, index: int, compile_bytes: bool = False) -> None:
+        self.rule = rule
+        self.index = index
+        self.pattern = re.compile(rule["pattern"], re.M)
+        self.exclude_pattern = (
+            re.compile(rule["exclude_pattern"]) if rule.get("exclude_pattern") else None
+        )
+        exclude_lines: Dict[str, Set[str]] = collections.defaultdict(set)
+        for fn, line in rule.get("exclude_line", set()):
+            exclude_lines[fn].add(line)
+        self.exclude_lines: Dict[str, FrozenSet[str]] = {
+            fn: frozenset(lines) for fn, lines in exclude_lines.items()
+        }
+        self.literal = required_literal(self.pattern)
+        self.bytes_pattern = (
+            compile_bytes_pattern(self.pattern) if compile_bytes else None
+        )
+        self.bytes_literal = (
+            None
+            if self.bytes_pattern is None or self.literal is None
+            else self.literal.encode("ascii")
+        )
+        self.bytes_needs_ascii = self.bytes_pattern is not None and (
+            needs_ascii_contents(self.bytes_pattern)
+        )
+
+
+class PrefixTrie:
+    """A trie of strings, for finding which of them are prefixes of a
+    path in a single pass over the path."""
+
+    def __init__(self, items: Iterable[Tuple[str, int]]) -> None:
+        self.children: List[Dict[str, int]] = [{}]
+        # The values of the items ending at each node.
+        self.values: List[FrozenSet[int]] = [frozenset()]
+        for item, value in items:
+            node = 0
+            for c in item:
+                child = self.children[node].get(c)
+                if child is None:
+                    child = len(self.children)
+                    self.children[node][c] = child
+                    self.children.append({})
+                    self.values.append(frozenset())
+                node = child
+            self.values[node] |= {value}
+
+
+class SubstringAutomaton(PrefixTrie):
+    """An Aho-Corasick automaton, for finding which of a set of strings
+    occur anywhere in a path in a single pass over the path."""
+
+    def __init__(self, items: Iterable[Tuple[str, int]]) -> None:
+        super().__init__(items)
+        # For each node, the node for the longest proper suffix of its
+        # string that is also in the trie.
+        self.fail = [0] * len(self.children)
+        queue = collections.deque(self.children[0].values())
+        while queue:
+            node = queue.popleft()
+            for c, child in self.children[node].items():
+                fail = self.fail[node]
+                while fail and c not in self.children[fail]:
+                    fail = self.fail[fail]
+                if node:
+                    self.fail[child] = self.children[fail].get(c, 0)
+                self.values[child] |= self.values[self.fail[child]]
+                queue.append(child)
+
+
+class PathState(NamedTuple):
+    exclude_node: int  # -1 once no exclude can match
+    include_only_node: int
+    excluded: FrozenSet[int]
+    included: FrozenSet[int]
+
+
+class RuleIndex:
+    """Indexes the exclude and include_only settings of a list of rules,
+    so that finding the rules that apply to a file takes time
+    proportional to the length of its path rather than to the number of
+    rules and exclusions.
+
+    Paths are fed to advance() incrementally, so that the state after a
+    directory name can be reused for every file in that directory.
+    """
+
+    def __init__(self, rules: Sequence[Rule]) -> None:
+        self.exclude = PrefixTrie(
+            (item, index)
+            for index, rule in enumerate(rules)
+            for item in rule.get("exclude", set())
+        )
+        self.include_only = SubstringAutomaton(
+            (item, index)
+            for index, rule in enumerate(rules)
+            for item in rule.get("include_only", set())
+        )
+        self.restricted = frozenset(
+            index for index, rule in enumerate(rules) if rule.get("include_only")
+        )
+        self.start = PathState(
+            0, 0, self.exclude.values[0], self.include_only.values[0]
+        )
+
+    def advance(self, state: PathState, text: str) -> PathState:
+        exclude_node, include_only_node, excluded, included = state
+
+        children = self.exclude.children
+        values = self.exclude.values
+        for c in text:
+            if exclude_node < 0:
+                break
+            exclude_node = children[exclude_node].get(c, -1)
+            if exclude_node >= 0 and values[exclude_node]:
+                excluded |= values[exclude_node]
+
+        children = self.include_only.children
+        fail = self.include_only.fail
+        values = self.include_only.values
+        for c in text:
+            while include_only_node and c not in children[include_only_node]:
+                include_only_node = fail[include_only_node]
+            include_only_node = children[include_only_node].get(c, 0)
+            if values[include_only_node]:
+                included |= values[include_only_node]
+
+        return PathState(exclude_node, include_only_node, excluded, included)
+
+
+class Violation(NamedTuple):
+    rule: int  # index into RuleList.rules
+    line_number: int
+    line: str
+
+
+class UnmatchedExclusions(NamedTuple):
+    lines: AbstractSet[str]
+
+
+class RuleTimeout(NamedTuple):
+    rule: int  # index into RuleList.rules
+
+
+class MoreViolations(NamedTuple):
+    rule: int  # index into RuleList.rules, whose max_errors was reached
+
+
+# The results of checking one file, in the order they should be printed.
+FileReport = List[Union[Violation, UnmatchedExclusions, RuleTimeout, MoreViolations]]
+
+# Ranges of line numbers, counted from 1 and inclusive at both ends.
+LineRanges = Sequence[Tuple[int, int]]
+
+
+class LineStarts:
+    """The offset at which each line of contents starts.
+
+    Most files match no rule at all, so the offsets are only computed
+    once a match needs its line number, and then stored compactly.
+    """
+
+    def __init__(self, contents: Union[str, mmap.mmap]) -> None:
+        self.contents = contents
+        self._starts: "Optional[array[int]]" = None
+
+    @property
+    def starts(self) -> "array[int]":
+        if self._starts is None:
+            starts = array("I", [0])
+            if isinstance(self.contents, str):
+                lines = self.contents.split("\n")
+                starts.extend(
+                    map(
+                        operator.add,
+                        itertools.accumulate(
+                            map(len, itertools.islice(lines, len(lines) - 1))
+                        ),
+                        itertools.count(1),
+                    )
+                )
+            else:
+                starts.extend(m.end() for m in re.finditer(b"\n", self.contents))
+            if starts[-1] == len(self.contents):
+                # A trailing newline doesn't start another line.
+                starts.pop()
+            self._starts = starts
+        return self._starts
+
+
+class RuleProfile:
+    """The time spent, violations found and files scanned for each rule
+    of a RuleList, and the time spent on each file."""
+
+    def __init__(self, rules: int) -> None:
+        self.seconds = [0.0] * rules
+        self.matches = [0] * rules
+        self.files = [0] * rules
+        self.file_seconds: Dict[str, float] = {}
+
+    def add_rule(self, index: int, seconds: float, matches: int) -> None:
+        self.seconds[index] += seconds
+        self.matches[index] += matches
+        self.files[index] += 1
+
+    def merge(self, other: "RuleProfile") -> None:
+        for index, seconds in enumerate(other.seconds):
+            self.seconds[index] += seconds
+            self.matches[index] += other.matches[index]
+            self.files[index] += other.files[index]
+        self.file_seconds.update(other.file_seconds)
+
+    def slowest_rules(self, top: Optional[int] = None) -> List[int]:
+        rules = sorted(range(len(self.seconds)), key=lambda i: -self.seconds[i])
+        return rules[:top]
+
+    def slowest_files(self, top: int) -> List[Tuple[str, float]]:
+        return heapq.nlargest(
+            top, self.file_seconds.items(), key=operator.itemgetter(1)
+        )
+
+
+def encode_report(report: FileReport) -> List[List[object]]:
+    return [
+        ["violation", *item]
+        if isinstance(item, Violation)
+        else ["rule_timeout", item.rule]
+        if isinstance(item, RuleTimeout)
+        else ["more_violations", item.rule]
+        if isinstance(item, MoreViolations)
+        else ["unmatched_exclusions", sorted(item.lines)]
+        for item in report
+    ]
+
+
+def decode_report(data: object) -> Optional[FileReport]:
+    if not isinstance(data, list):
+        return None
+    return [
+        Violation(*item[1:])
+        if item[0] == "violation"
+        else RuleTimeout(item[1])
+        if item[0] == "rule_timeout"
+        else MoreViolations(item[1])
+        if item[0] == "more_violations"
+        else UnmatchedExclusions(set(item[1]))
+        for item in data
+    ]
+
+
+def finditer_in_line_ranges(
+    finditer: Callable[[int], Iterator[Match[AnyStr]]],
+    length: int,
+    line_starts: Sequence[int],
+    line_ranges: LineRanges,
+) -> Iterator[Match[AnyStr]]:
+    """Yields the matches found by finditer(pos) in contents of the given
+    length that start within line_ranges.
+
+    The search isn't cut off after each range, since end anchors and
+    lookaheads must see the rest of the file.  Instead, the first match
+    past a range is kept for the following ranges: no match starts
+    between a range and it, so ranges that end before it are skipped
+    rather than searched.
+    """
+    matches: Iterator[Match[AnyStr]] = iter(())
+    pending: Optional[Match[AnyStr]] = None
+    searched = False
+    last_end = 0
+    for first, last in sorted(line_ranges):
+        if first > len(line_starts):
+            break
+        start = max(line_starts[max(first, 1) - 1], last_end)
+        stop = line_starts[last] if last < len(line_starts) else length
+        if not searched or (pending is not None and pending.start() < start):
+            matches = finditer(start)
+            pending = next(matches, None)
+            searched = True
+        while pending is not None and pending.start() < stop:
+            last_end = max(pending.end(), pending.start() + 1)
+            yield pending
+            pending = next(matches, None)
+        if pending is None:
+            # There are no more matches anywhere after this range.
+            break
+
+
+def lines_at_offsets(
+    offsets: Iterable[int],
+    line_starts: LineStarts,
+    length: int,
+    get_line: Callable[[int, int], str],
+) -> Iterator[Tuple[int, str]]:
+    """Yields the index and text of the line containing each offset,
+    getting the text with get_line(start, end).
+
+    The offsets must be in increasing order, like matches, so each
+    line is searched for only after the previous offset's line, and a
+    line containing several offsets is only got once.
+    """
+    i = 0
+    line = ""
+    # Where line i ends; before any line has been got, nothing is on it.
+    line_end = -1
+    for offset in offsets:
+        if offset >= line_end:
+            starts = line_starts.starts
+            i = bisect.bisect(starts, offset, i) - 1
+            line_end = starts[i + 1] if i + 1 < len(starts) else length + 1
+            line = get_line(starts[i], min(line_end, length))
+        yield i, line
+
+
+def find_matched_lines(
+    rule: CompiledRule,
+    contents: Union[str, mmap.mmap],
+    line_starts: LineStarts,
+    line_ranges: Optional[LineRanges],
+) -> Iterator[Tuple[int, str]]:
+    """Yields the index and text of the line where each match of rule
+    starts.  If contents is a memory-mapped file, only those lines are
+    decoded."""
+    if not contents:
+        # There are no lines for an empty match to be on.
+        return
+    if isinstance(contents, str):
+        if rule.literal is not None and rule.literal not in contents:
+            # Cheap substring search proves the pattern can't match.
+            return
+        pattern = rule.pattern
+        if line_ranges is not None:
+            matches = finditer_in_line_ranges(
+                lambda pos: pattern.finditer(contents, pos),
+                len(contents),
+                line_starts.starts,
+                line_ranges,
+            )
+        else:
+            matches = pattern.finditer(contents)
+        yield from lines_at_offsets(
+            map(re.Match.start, matches),
+            line_starts,
+            len(contents),
+            lambda start, end: contents[start:end],
+        )
+        return
+
+    bytes_pattern = rule.bytes_pattern
+    assert bytes_pattern is not None
+    if rule.bytes_literal is not None and contents.find(rule.bytes_literal) < 0:
+        return
+    if line_ranges is not None:
+        bytes_matches = finditer_in_line_ranges(
+            lambda pos: bytes_pattern.finditer(contents, pos),
+            len(contents),
+            line_starts.starts,
+            line_ranges,
+        )
+    else:
+        bytes_matches = bytes_pattern.finditer(contents)
+    # Matches hold a view of the mapping, so none are kept around.
+    yield from lines_at_offsets(
+        [m.start() for m in bytes_matches],
+        line_starts,
+        len(contents),
+        lambda start, end: contents[start:end].decode("utf-8", "replace"),
+    )
+
+
+class CompiledRules(NamedTuple):
+    rules: List[CompiledRule]
+    rule_index: RuleIndex
+    # Warnings about rules that may backtrack catastrophically.
+    backtracking: List[str]
+
+
+def compile_rules(rules: Sequence[Rule], compile_bytes: bool) -> CompiledRules:
+    compiled_rules = [
+        CompiledRule(rule, index, compile_bytes=compile_bytes)
+        for index, rule in enumerate(rules)
+    ]
+    backtracking = [
+        "Rule {!r} has nested quantifiers, which may backtrack "
+        "catastrophically: {}".format(rule.rule["description"], rule.rule["pattern"])
+        for rule in compiled_rules
+        if has_nested_quantifier(parse_pattern(rule.pattern))
+    ]
+    return CompiledRules(compiled_rules, RuleIndex(rules), backtracking)
+
+
+# Compiled rules by fingerprint.  The daemon loads the lint script once
+# and forks for each run, which executes the script again; its
+# RuleLists find their rules here instead of compiling them again.
+compiled_rule_lists: Dict[str, CompiledRules] = {}
+
+
 class RuleList:
     """Defines and runs custom linting rules for the specified language."""
 
@@ -26,42 +604,94 @@ class RuleList:
         langs: Sequence[str],
         rules: Sequence[Rule],
         exclude_files_in: Optional[str] = None,
+        mmap_threshold: Optional[int] = None,
+        rule_timeout: Optional[float] = None,
     ) -> None:
         self.langs = langs
         self.rules = rules
+        # Files of at least this many bytes are memory-mapped and
+        # scanned as bytes instead of being decoded in full.
+        self.mmap_threshold = mmap_threshold
+        # Each rule may spend this many seconds on each file before it's
+        # interrupted and reported, e.g. for catastrophic backtracking.
+        if rule_timeout is not None and not hasattr(signal, "setitimer"):
+            warnings.warn(
+                "rule_timeout is not supported on this platform", stacklevel=2
+            )
+            rule_timeout = None
+        self.rule_timeout = rule_timeout
+        self.rules_fingerprint: Optional[str] = None
+        # Compiling every rule once up front, rather than leaning on
+        # re's small internal cache, matters with hundreds of rules.
+        compiled = compiled_rule_lists.get(self.fingerprint())
+        if compiled is None:
+            compiled = compile_rules(rules, compile_bytes=mmap_threshold is not None)
+            compiled_rule_lists[self.fingerprint()] = compiled
+        self.compiled_rules = compiled.rules
+        self.rule_index = compiled.rule_index
+        for message in compiled.backtracking:
+            warnings.warn(message, BacktrackingWarning, stacklevel=2)
+        # Files in the same directory share the state of the index after
+        # their directory name, and usually the same applicable rules.
+        self.directory_states: Dict[str, PathState] = {}
+        self.applicable_rules: Dict[
+            Tuple[FrozenSet[int], FrozenSet[int]], List[CompiledRule]
+        ] = {}
         # Exclude the files in this folder from rules
         self.exclude_files_in = "\\"
         self.verbose = False
+        self.profile: Optional[RuleProfile] = None
+
+    def rule_applies_to_fn(self, fn: str, rule: Rule) -> bool:
+        for item in rule.get("exclude", set()):
+            if fn.startswith(item):
+                return False
+        if rule.get("include_only"):
+            found = False
+            for item in rule.get("include_only", set()):
+                if item in fn:
+                    found = True
+            if not found:
+                return False
+        return True
 
     def get_rules_applying_to_fn(self, fn: str, rules: Sequence[Rule]) -> List[Rule]:
-        rules_to_apply = []
-        for rule in rules:
-            excluded = False
-            for item in rule.get("exclude", set()):
-                if fn.startswith(item):
-                    excluded = True
-                    break
-            if excluded:
-                continue
-            if rule.get("include_only"):
-                found = False
-                for item in rule.get("include_only", set()):
-                    if item in fn:
-                        found = True
-                if not found:
-                    continue
-            rules_to_apply.append(rule)
+        if rules is self.rules:
+            return [rule.rule for rule in self.get_compiled_rules_applying_to_fn(fn)]
+        return [rule for rule in rules if self.rule_applies_to_fn(fn, rule)]
 
-        return rules_to_apply
+    def get_compiled_rules_applying_to_fn(self, fn: str) -> List[CompiledRule]:
+        split = fn.rfind("/") + 1
+        directory = fn[:split]
+        state = self.directory_states.get(directory)
+        if state is None:
+            state = self.rule_index.advance(self.rule_index.start, directory)
+            self.directory_states[directory] = state
+        state = self.rule_index.advance(state, fn[split:])
+
+        key = (state.excluded, state.included)
+        rules = self.applicable_rules.get(key)
+        if rules is None:
+            rules = [
+                rule
+                for rule in self.compiled_rules
+                if rule.index not in state.excluded
+                and (
+                    rule.index not in self.rule_index.restricted
+                    or rule.index in state.included
+                )
+            ]
+            self.applicable_rules[key] = rules
+        return rules
 
     def check_file_for_pattern(
         self,
         fn: str,
-        contents: str,
-        line_starts: Sequence[int],
-        identifier: str,
-        color: str,
-        rule: Rule,
+        contents: Union[str, mmap.mmap],
+        line_starts: LineStarts,
+        rule: CompiledRule,
+        report: FileReport,
+        line_ranges: Optional[LineRanges] = None,
     ) -> bool:
         """
         DO NOT MODIFY THIS FUNCTION WITHOUT PROFILING.
@@ -73,35 +703,90 @@ class RuleList:
         We need to see it show up in profiles, and the function call
         overhead will never be a bottleneck.
         """
-        exclude_lines = {
-            line
-            for (exclude_fn, line) in rule.get("exclude_line", set())
-            if exclude_fn == fn
-        }
-        unmatched_exclude_lines = exclude_lines.copy()
+        exclude_lines = rule.exclude_lines.get(fn, frozenset())
+        unmatched_exclude_lines = set(exclude_lines)
+        exclude_pattern = rule.exclude_pattern
+        errors_left = rule.rule.get("max_errors")
 
         ok = True
-        for m in re.finditer(rule["pattern"], contents, re.M):
-            i = bisect.bisect(line_starts, m.start()) - 1
-            line = contents[
-                line_starts[i] : line_starts[i + 1]
-                if i + 1 < len(line_starts)
-                else None
-            ]
+        for i, line in find_matched_lines(rule, contents, line_starts, line_ranges):
             line_fully_stripped = line.strip()
             if line_fully_stripped in exclude_lines:
                 unmatched_exclude_lines.discard(line_fully_stripped)
                 continue
-            if rule.get("exclude_pattern") and re.search(
-                rule["exclude_pattern"], line_fully_stripped
+            if exclude_pattern is not None and exclude_pattern.search(
+                line_fully_stripped
             ):
                 continue
-            self.print_error(rule, line, identifier, color, fn, i + 1)
+            report.append(Violation(rule.index, i + 1, line))
             ok = False
+            if errors_left is not None:
+                errors_left -= 1
+                if errors_left <= 0:
+                    # Stop scanning; the exclusions we didn't get to
+                    # might yet match.
+                    report.append(MoreViolations(rule.index))
+                    return ok
+
+        # Exclusions on unchanged lines are expected to go unmatched.
+        if unmatched_exclude_lines and line_ranges is None:
+            report.append(UnmatchedExclusions(unmatched_exclude_lines))
+
+        return ok
 
-        if unmatched_exclude_lines:
-            print(f"Please remove exclusions for file {fn}: {unmatched_exclude_lines}")
+    def profile_file_for_pattern(
+        self,
+        check_file_for_pattern: Callable[..., bool],
+        fn: str,
+        contents: Union[str, mmap.mmap],
+        line_starts: LineStarts,
+        rule: CompiledRule,
+        report: FileReport,
+        line_ranges: Optional[LineRanges] = None,
+    ) -> bool:
+        """Runs check_file_for_pattern, recording its cost in self.profile."""
+        assert self.profile is not None
+        violations = len(report)
+        start = time.perf_counter()
+        ok = check_file_for_pattern(
+            fn, contents, line_starts, rule, report, line_ranges
+        )
+        violations = sum(isinstance(item, Violation) for item in report[violations:])
+        self.profile.add_rule(rule.index, time.perf_counter() - start, violations)
+        return ok
 
+    def guard_file_for_pattern(
+        self,
+        check_file_for_pattern: Callable[..., bool],
+        fn: str,
+        contents: Union[str, mmap.mmap],
+        line_starts: LineStarts,
+        rule: CompiledRule,
+        report: FileReport,
+        line_ranges: Optional[LineRanges] = None,
+    ) -> bool:
+        """Runs check_file_for_pattern, interrupting it with a RuleTimeout
+        once it has taken self.rule_timeout seconds.  The caller must be
+        handling SIGALRM with raise_rule_timeout."""
+        assert self.rule_timeout is not None
+        violations = len(report)
+        ok = finished = False
+        try:
+            try:
+                signal.setitimer(signal.ITIMER_REAL, self.rule_timeout)
+                ok = check_file_for_pattern(
+                    fn, contents, line_starts, rule, report, line_ranges
+                )
+                finished = True
+            finally:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        except RuleTimeoutError:
+            # The timer may also go off after the check has finished,
+            # but before it's disarmed; then its results stand.
+            if not finished:
+                del report[violations:]
+                report.append(RuleTimeout(rule.index))
+                return False
         return ok
 
     def print_error(
@@ -142,36 +827,305 @@ class RuleList:
                 )
             print_err(identifier, color, "")
 
-    def custom_check_file(
-        self,
-        fn: str,
-        identifier: str,
-        color: str,
-    ) -> bool:
-        failed = False
+    def print_report(
+        self, fn: str, identifier: str, color: str, report: FileReport
+    ) -> None:
+        linter = results.current_linter() or identifier
+        for item in report:
+            if isinstance(item, Violation):
+                rule = self.rules[item.rule]
+                self.print_error(
+                    rule, item.line, identifier, color, fn, item.line_number
+                )
+                results.report_finding(
+                    linter,
+                    fn,
+                    item.line_number,
+                    rule["description"],
+                    language=identifier,
+                    source=item.line.rstrip("\n"),
+                )
+            elif isinstance(item, RuleTimeout):
+                rule = self.rules[item.rule]
+                print_err(
+                    identifier,
+                    color,
+                    "{} {}timed out after {}s at {}:{} {}".format(
+                        YELLOW + rule["description"],
+                        BLUE,
+                        self.rule_timeout,
+                        fn,
+                        ENDC,
+                        rule["pattern"],
+                    ),
+                )
+                results.report_finding(
+                    linter,
+                    fn,
+                    None,
+                    "{} timed out after {}s".format(
+                        rule["description"], self.rule_timeout
+                    ),
+                    language=identifier,
+                    pattern=rule["pattern"],
+                )
+            elif isinstance(item, MoreViolations):
+                rule = self.rules[item.rule]
+                print_err(
+                    identifier,
+                    color,
+                    "{} {}stopped at max_errors={} in {}".format(
+                        YELLOW + rule["description"], BLUE, rule["max_errors"], fn
+                    ),
+                )
+            else:
+                message = f"Please remove exclusions for file {fn}: {item.lines}"
+                print(message, file=text_stream())
+                results.report_finding(linter, fn, None, message, language=identifier)
+
+    def print_profile(self, top: int) -> None:
+        """Prints the top slowest rules and files, and reports the time
+        spent on every rule as structured results."""
+        profile = self.profile
+        assert profile is not None
+        name = results.current_linter() or ",".join(self.langs)
+        lines = [
+            "Rule profile of {} files, {:.3f}s:".format(
+                len(profile.file_seconds), sum(profile.file_seconds.values())
+            ),
+            "   seconds  matches    files  rule",
+        ]
+        for index in profile.slowest_rules():
+            rule = self.rules[index]
+            seconds = profile.seconds[index]
+            matches = profile.matches[index]
+            files = profile.files[index]
+            if len(lines) < top + 2:
+                lines.append(
+                    f"{seconds:10.4f} {matches:8} {files:8}  {rule['description']}"
+                )
+            results.report_profile(
+                name,
+                rule=index,
+                description=rule["description"],
+                pattern=rule["pattern"],
+                seconds=seconds,
+                matches=matches,
+                files=files,
+            )
+        lines.append("Slowest files:")
+        for fn, seconds in profile.slowest_files(top):
+            lines.append(f"{seconds:10.4f}  {fn}")
+            results.report_profile(name, path=fn, seconds=seconds)
+        print_lines(name, BLUE, lines)
+
+    def get_file_report(
+        self, fn: str, line_ranges: Optional[LineRanges] = None
+    ) -> FileReport:
+        if self.profile is None:
+            return self.scan_file(fn, line_ranges)
+        start = time.perf_counter()
+        report = self.scan_file(fn, line_ranges)
+        self.profile.file_seconds[fn] = time.perf_counter() - start
+        return report
+
+    def scan_file(self, fn: str, line_ranges: Optional[LineRanges]) -> FileReport:
+        report: FileReport = []
+        rules_to_apply = self.get_compiled_rules_applying_to_fn(fn)
+        check_file_for_pattern: Callable[..., bool] = self.check_file_for_pattern
+        if self.rule_timeout is not None:
+            check_file_for_pattern = functools.partial(
+                self.guard_file_for_pattern, check_file_for_pattern
+            )
+        if self.profile is not None:
+            check_file_for_pattern = functools.partial(
+                self.profile_file_for_pattern, check_file_for_pattern
+            )
+
+        if self.mmap_threshold is not None and os.path.getsize(fn) >= max(
+            self.mmap_threshold, 1
+        ):
+            self.check_mapped_file(
+                fn, rules_to_apply, report, line_ranges, check_file_for_pattern
+            )
+            return report
 
         with open(fn, encoding="utf8") as f:
             contents = f.read()
-        line_starts = [m.start() for m in re.finditer(r"^.", contents, re.M | re.S)]
-
-        rules_to_apply = self.get_rules_applying_to_fn(fn=fn, rules=self.rules)
+        line_starts = LineStarts(contents)
 
         for rule in rules_to_apply:
-            ok = self.check_file_for_pattern(
+            check_file_for_pattern(
                 fn=fn,
                 contents=contents,
                 line_starts=line_starts,
-                identifier=identifier,
-                color=color,
                 rule=rule,
+                report=report,
+                line_ranges=line_ranges,
             )
-            if not ok:
-                failed = True
 
-        return failed
+        return report
+
+    def check_mapped_file(
+        self,
+        fn: str,
+        rules_to_apply: Iterable[CompiledRule],
+        report: FileReport,
+        line_ranges: Optional[LineRanges],
+        check_file_for_pattern: Callable[..., bool],
+    ) -> None:
+        """Checks a memory-mapped file, decoding it only for the rules
+        whose patterns can't be matched against bytes."""
+        with open(fn, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data:
+            mapped_line_starts = LineStarts(data)
+            # Text mode would translate \r and \r\n into \n.
+            has_carriage_returns = data.find(b"\r") >= 0
+            is_ascii: Optional[bool] = None
+            text: Optional[Tuple[str, LineStarts]] = None
+            for rule in rules_to_apply:
+                if rule.bytes_needs_ascii and is_ascii is None:
+                    is_ascii = NON_ASCII_RE.search(data) is None
+                if (
+                    rule.bytes_pattern is not None
+                    and not has_carriage_returns
+                    and (is_ascii or not rule.bytes_needs_ascii)
+                ):
+                    contents: Union[str, mmap.mmap] = data
+                    line_starts = mapped_line_starts
+                else:
+                    if text is None:
+                        # Translate newlines, as open() does in text mode.
+                        decoded = data[:].decode("utf-8")
+                        decoded = decoded.replace("\r\n", "\n").replace("\r", "\n")
+                        text = (decoded, LineStarts(decoded))
+                    contents, line_starts = text
+                check_file_for_pattern(
+                    fn=fn,
+                    contents=contents,
+                    line_starts=line_starts,
+                    rule=rule,
+                    report=report,
+                    line_ranges=line_ranges,
+                )
+
+    def get_file_reports(
+        self,
+        fns: Sequence[str],
+        cache: Optional[ResultCache],
+        jobs: Optional[int],
+        line_ranges: Optional[Mapping[str, LineRanges]] = None,
+    ) -> Iterator[FileReport]:
+        """Yields the report for each of fns in order, replaying cached
+        reports and checking the remaining files across jobs processes."""
+        ranges = [None if line_ranges is None else line_ranges[fn] for fn in fns]
+        keys: List[str] = []
+        cached_reports: List[Optional[FileReport]] = [None] * len(fns)
+        if cache is not None:
+            fingerprint = self.fingerprint()
+            keys = [
+                cache.key("rules", fingerprint, fn, cache.file_hash(fn), fn_ranges)
+                for fn, fn_ranges in zip(fns, ranges)
+            ]
+            cached_reports = [decode_report(cache.get(key)) for key in keys]
+        misses = [
+            (fn, fn_ranges)
+            for fn, fn_ranges, report in zip(fns, ranges, cached_reports)
+            if report is None
+        ]
+
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        with contextlib.ExitStack() as stack:
+            in_process = jobs == 1 or len(misses) < PARALLEL_MIN_FILES
+            if in_process and self.rule_timeout is not None:
+                if threading.current_thread() is threading.main_thread():
+                    stack.enter_context(handle_rule_timeouts())
+                else:
+                    # Only the main thread can handle SIGALRM, so check
+                    # the files in a worker process instead.
+                    in_process = False
+            if in_process:
+                fresh_reports: Iterator[FileReport] = itertools.starmap(
+                    self.get_file_report, misses
+                )
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+
+                jobs = max(jobs, 1)
+                executor = stack.enter_context(
+                    ProcessPoolExecutor(
+                        jobs, initializer=init_check_worker, initargs=(self,)
+                    )
+                )
+                chunk_size = -(-len(misses) // (jobs * 4))
+                chunks = [
+                    misses[i : i + chunk_size]
+                    for i in range(0, len(misses), chunk_size)
+                ]
+                fresh_reports = itertools.chain.from_iterable(
+                    map(
+                        self.merge_worker_profile,
+                        executor.map(check_files_worker, chunks),
+                    )
+                )
+
+            for i, cached_report in enumerate(cached_reports):
+                if cached_report is not None:
+                    yield cached_report
+                    continue
+                report = next(fresh_reports)
+                # Timeouts depend on the load on the machine.
+                if cache is not None and not any(
+                    isinstance(item, RuleTimeout) for item in report
+                ):
+                    cache.set(keys[i], encode_report(report))
+                yield report
+
+    def merge_worker_profile(
+        self, result: Tuple[List[FileReport], Optional[RuleProfile]]
+    ) -> List[FileReport]:
+        reports, profile = result
+        if profile is not None:
+            assert self.profile is not None
+            self.profile.merge(profile)
+        return reports
+
+    def fingerprint(self) -> str:
+        """Returns a stable description of the rules, for use in cache keys."""
+        if self.rules_fingerprint is None:
+
+            def encode(value: object) -> object:
+                if isinstance(value, (set, frozenset)):
+                    return sorted(json.dumps(encode(item)) for item in value)
+                if isinstance(value, (list, tuple)):
+                    return [encode(item) for item in value]
+                return value
+
+            rules = [{k: encode(v) for k, v in rule.items()} for rule in self.rules]
+            data = json.dumps([sys.version, rules, self.mmap_threshold], sort_keys=True)
+            self.rules_fingerprint = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        return self.rules_fingerprint
+
+    def custom_check_file(
+        self,
+        fn: str,
+        identifier: str,
+        color: str,
+    ) -> bool:
+        report = self.get_file_report(fn)
+        self.print_report(fn, identifier, color, report)
+        return any(isinstance(item, (Violation, RuleTimeout)) for item in report)
 
     def check(
-        self, by_lang: Mapping[str, Sequence[str]], verbose: bool = False
+        self,
+        by_lang: Mapping[str, Sequence[str]],
+        verbose: bool = False,
+        cache: Optional[ResultCache] = None,
+        jobs: Optional[int] = 1,
+        line_ranges: Optional[Mapping[str, LineRanges]] = None,
+        profile: Optional[int] = None,
     ) -> bool:
         # By default, a rule applies to all files within the extension for
         # which it is specified (e.g. all .py files)
@@ -183,8 +1137,26 @@ class RuleList:
         #                                                  in the file <path> from linting.
         # 'include_only': 'set([<path>, ...])' - includes only those files where <path> is a
         #                                        substring of the filepath.
+        #
+        # If a cache is passed, files whose contents and rules haven't
+        # changed since a previous run have their results replayed
+        # instead of being checked again.
+        #
+        # Files are checked in parallel across jobs processes (all
+        # CPUs if None), but results are always printed in the same order.
+        #
+        # If line_ranges is given, only the files it contains are checked,
+        # and only for violations starting within their ranges of lines,
+        # e.g. those changed by a diff.
+        #
+        # If profile is given, every file is checked without the cache,
+        # and the profile slowest rules and files are printed at the end.
         failed = False
         self.verbose = verbose
+        if profile is not None:
+            self.profile = RuleProfile(len(self.rules))
+            cache = None
+        files = []
         for lang in self.langs:
             color = next(colors)
             for fn in by_lang[lang]:
@@ -194,7 +1166,52 @@ class RuleList:
                     #
                     # TODO: Migrate this to looking at __module__ type attributes.
                     continue
-                if self.custom_check_file(fn, lang, color):
-                    failed = True
+                if line_ranges is not None and fn not in line_ranges:
+                    continue
+                files.append((fn, lang, color))
+
+        reports = self.get_file_reports(
+            [fn for fn, _, _ in files], cache, jobs, line_ranges
+        )
+        for (fn, lang, color), report in zip(files, reports):
+            self.print_report(fn, lang, color, report)
+            if any(isinstance(item, (Violation, RuleTimeout)) for item in report):
+                failed = True
 
+        if profile is not None:
+            self.print_profile(profile)
+            self.profile = None
         return failed
+
+
+worker_rule_list: Optional[RuleList] = None
+
+
+@contextlib.contextmanager
+def handle_rule_timeouts() -> Iterator[None]:
+    old_handler = signal.signal(signal.SIGALRM, raise_rule_timeout)
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+def init_check_worker(rule_list: RuleList) -> None:
+    global worker_rule_list  # noqa: PLW0603
+    worker_rule_list = rule_list
+    if rule_list.rule_timeout is not None:
+        signal.signal(signal.SIGALRM, raise_rule_timeout)
+
+
+def check_files_worker(
+    files: Sequence[Tuple[str, Optional[LineRanges]]],
+) -> Tuple[List[FileReport], Optional[RuleProfile]]:
+    assert worker_rule_list is not None
+    reports = [
+        worker_rule_list.get_file_report(fn, line_ranges) for fn, line_ranges in files
+    ]
+    # Send back this chunk's profile, and start afresh for the next one.
+    profile = worker_rule_list.profile
+    if profile is not None:
+        worker_rule_list.profile = RuleProfile(len(worker_rule_list.rules))
+    return reports, profile
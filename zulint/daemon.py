@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+import argparse
+import array
+import contextlib
+import json
+import os
+import runpy
+import select
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from zulint import lister
+
+SOCKET_NAME = "zulint.sock"
+# The client passes its stdin, stdout and stderr.
+PASSED_FDS = 3
+
+
+def wait_status_to_exit_code(status: int) -> int:
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def is_same_user(conn: socket.socket) -> bool:
+    if not hasattr(socket, "SO_PEERCRED"):
+        # The socket's permissions will have to do.
+        return True
+    pid, uid, gid = struct.unpack(
+        "3i",
+        conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")),
+    )
+    return bool(uid == os.getuid())
+
+
+def receive_request(
+    conn: socket.socket,
+) -> Optional[Tuple[Dict[str, object], List[int]]]:
+    """Reads a client's request, a line of JSON, and the descriptors it
+    sent along with it, or returns None if the request is malformed."""
+    fds = array.array("i")
+    data, ancdata, _, _ = conn.recvmsg(
+        65536, socket.CMSG_SPACE(PASSED_FDS * fds.itemsize)
+    )
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[: len(cdata) - len(cdata) % fds.itemsize])
+    while data and not data.endswith(b"\n"):
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    request = json.loads(data) if data.endswith(b"\n") else None
+    if not isinstance(request, dict) or len(fds) != PASSED_FDS:
+        for fd in fds:
+            os.close(fd)
+        return None
+    return request, list(fds)
+
+
+def run_script(script: str, request: Dict[str, object]) -> int:
+    """Runs the lint script, in a forked child, as if it had been started
+    with the client's arguments, directory and environment, and returns
+    its exit code."""
+    argv = request["argv"]
+    cwd = request["cwd"]
+    env = request["env"]
+    assert isinstance(argv, list) and isinstance(cwd, str) and isinstance(env, dict)
+    os.chdir(cwd)
+    os.environ.clear()
+    os.environ.update(env)
+    sys.argv = [script, *argv]
+    # Reopen the standard streams on the client's descriptors, so that
+    # buffering is chosen for them rather than for ours.
+    sys.stdin = open(0, closefd=False)  # noqa: SIM115
+    sys.stdout = open(1, "w", closefd=False)  # noqa: SIM115
+    sys.stderr = open(2, "w", buffering=1, closefd=False)  # noqa: SIM115
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+        print(e.code, file=sys.stderr)
+        return 1
+    return 0
+
+
+class Daemon:
+    """
+    Serves lint runs for a repository from forks of one long-lived
+    process, in which the lint script's imports and module-level setup
+    (like RuleLists) and a snapshot of git's index are already loaded.
+
+    Runs are served one at a time, each in a child process that uses
+    the client's standard streams directly, so that its output is just
+    as if the client had run the script itself.
+    """
+
+    def __init__(self, script: str, socket_path: str, poll_interval: float) -> None:
+        self.script = script
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+
+    def refresh_index(self) -> None:
+        """Takes a new snapshot of git's index if it has changed, and
+        determines the types of the files without an extension."""
+        snapshot = lister.index_snapshot
+        if snapshot is not None and snapshot.is_current():
+            return
+        lister.index_snapshot = None
+        snapshot = lister.IndexSnapshot()
+        lister.index_snapshot = snapshot
+        lister.get_ftypes(
+            [path for path in snapshot.paths if not os.path.splitext(path)[1]],
+            use_shebang=True,
+            blob_shas={
+                path: blob_sha
+                for path, (_, blob_sha, _, _) in zip(snapshot.paths, snapshot.entries)
+                if blob_sha is not None
+            },
+        )
+
+    def listen(self) -> socket.socket:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # Nobody is listening; remove any stale socket.
+                with contextlib.suppress(OSError):
+                    os.unlink(self.socket_path)
+            else:
+                sys.exit(f"zulint: a daemon is already listening on {self.socket_path}")
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # Only our own user may connect, since clients choose what runs.
+        old_umask = os.umask(0o177)
+        try:
+            listener.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        listener.listen()
+        return listener
+
+    def serve(self) -> None:
+        # Load the script's imports and module-level state, without
+        # running it.
+        runpy.run_path(self.script, run_name="__zulint_daemon__")
+        self.refresh_index()
+        listener = self.listen()
+        print(f"zulint: listening on {self.socket_path}", flush=True)
+        try:
+            while True:
+                readable, _, _ = select.select([listener], [], [], self.poll_interval)
+                self.refresh_index()
+                if readable:
+                    conn, _ = listener.accept()
+                    with conn:
+                        self.handle(listener, conn)
+        finally:
+            listener.close()
+            os.unlink(self.socket_path)
+
+    def handle(self, listener: socket.socket, conn: socket.socket) -> None:
+        if not is_same_user(conn):
+            return
+        received = receive_request(conn)
+        if received is None:
+            return
+        request, fds = received
+
+        # The child holds the write end of this pipe, so reading EOF
+        # from it means the child has exited.
+        done_r, done_w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                listener.close()
+                conn.close()
+                os.close(done_r)
+                os.setpgid(0, 0)
+                for target_fd, fd in enumerate(fds):
+                    os.dup2(fd, target_fd)
+                    if fd not in range(PASSED_FDS):
+                        os.close(fd)
+                code = run_script(self.script, request)
+            except BaseException:  # noqa: BLE001
+                traceback.print_exc()
+            finally:
+                for stream in (sys.stdout, sys.stderr):
+                    with contextlib.suppress(OSError):
+                        stream.flush()
+                os._exit(code)
+
+        os.close(done_w)
+        for fd in fds:
+            os.close(fd)
+        with contextlib.suppress(OSError):
+            os.setpgid(pid, pid)
+        try:
+            self.wait_for_run(conn, pid, done_r)
+        finally:
+            os.close(done_r)
+            _, status = os.waitpid(pid, 0)
+        with contextlib.suppress(OSError):
+            conn.sendall(b"%d\n" % wait_status_to_exit_code(status))
+
+    def wait_for_run(self, conn: socket.socket, pid: int, done_r: int) -> None:
+        while True:
+            readable, _, _ = select.select([conn.fileno(), done_r], [], [])
+            if done_r in readable:
+                return
+            if not conn.recv(1):
+                # The client went away, e.g. on ^C; interrupt its run as
+                # ^C would, so that it terminates the commands it started.
+                with contextlib.suppress(OSError):
+                    os.killpg(pid, signal.SIGINT)
+                select.select([done_r], [], [])
+                return
+
+
+def get_socket_path() -> str:
+    return lister.get_git_path(SOCKET_NAME)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Keep a lint script loaded, so that python -m zulint.client "
+        "can run it without starting it afresh"
+    )
+    parser.add_argument("script", help="the lint script, e.g. tools/lint")
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help=f"listen on PATH instead of .git/{SOCKET_NAME}",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=float,
+        default=2,
+        metavar="SECONDS",
+        help="how often to check whether git's index has changed (default 2)",
+    )
+    args = parser.parse_args()
+
+    script = os.path.abspath(args.script)
+    socket_path = os.path.abspath(args.socket or get_socket_path())
+    # Snapshot the index from the root, so that it covers every file.
+    root = (
+        subprocess.check_output(["git", "rev-parse", "--show-toplevel"])
+        .strip()
+        .decode("utf-8")
+    )
+    os.chdir(root)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with contextlib.suppress(KeyboardInterrupt):
+        Daemon(script, socket_path, args.poll_interval).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,96 @@
+import contextlib
+import heapq
+import locale
+import os
 import signal
 import subprocess
-from typing import Callable, Sequence
+import threading
+from typing import Callable, Iterator, List, Optional, Sequence, Set, Tuple
 
-from zulint.printer import print_err
+from zulint.printer import BlockPrinter, LineDecoder, print_output
+
+# Subprocess output is read in chunks of up to this many bytes.
+CHUNK_SIZE = 65536
+
+# Commands run in process groups of their own, so that everything they
+# start can be terminated with them.  These are the groups of the
+# commands running in this process.
+running_process_groups: Set[int] = set()
+process_groups_lock = threading.Lock()
+
+
+def terminate_process_group(pgid: int) -> None:
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(pgid, signal.SIGTERM)
+
+
+def terminate_process_groups() -> None:
+    """Terminates every command running in this process, e.g. for
+    --fail-fast."""
+    with process_groups_lock:
+        pgids = list(running_process_groups)
+    for pgid in pgids:
+        terminate_process_group(pgid)
+
+
+@contextlib.contextmanager
+def process_group(pgid: int) -> Iterator[None]:
+    """Registers a command's process group while it runs, and terminates
+    it if we are interrupted or cancelled before it finishes."""
+    with process_groups_lock:
+        running_process_groups.add(pgid)
+    try:
+        yield
+    except BaseException:
+        terminate_process_group(pgid)
+        raise
+    finally:
+        with process_groups_lock:
+            running_process_groups.discard(pgid)
+
+
+def termination_message(command: Sequence[str], returncode: int) -> str:
+    try:
+        signal_name = signal.Signals(-returncode).name
+    except (AttributeError, ValueError):
+        signal_name = f"signal {-returncode}"
+    return f"{command[0]} terminated by {signal_name}"
+
+
+class OutputHandler:
+    """Filters the lines a command outputs, then prints them in blocks
+    and/or collects them."""
+
+    def __init__(
+        self,
+        name: str,
+        color: str,
+        suppress_line: Callable[[str], bool],
+        output: Optional[List[str]],
+        echo: bool,
+        grouped: bool,
+    ) -> None:
+        self.decoder = LineDecoder(locale.getpreferredencoding(False))
+        self.suppress_line = suppress_line
+        self.output = output
+        self.printer = BlockPrinter(name, color, grouped) if echo else None
+
+    def emit(self, lines: List[str]) -> None:
+        if self.printer is not None:
+            self.printer.write(lines)
+        if self.output is not None:
+            self.output += lines
+
+    def feed(self, data: bytes, final: bool = False) -> None:
+        lines = self.decoder.decode(data, final)
+        self.emit([line for line in lines if not self.suppress_line(line)])
+
+    def finish(self, command: Sequence[str], returncode: int) -> None:
+        self.feed(b"", final=True)
+        if returncode < 0:
+            self.emit([termination_message(command, returncode)])
+        if self.printer is not None:
+            self.printer.close()
 
 
 def run_command(
@@ -10,21 +98,137 @@ def run_command(
     color: str,
     command: Sequence[str],
     suppress_line: Callable[[str], bool] = lambda line: False,
+    output: Optional[List[str]] = None,
+    echo: bool = True,
+    grouped: bool = False,
 ) -> int:
+    handler = OutputHandler(name, color, suppress_line, output, echo, grouped)
     with subprocess.Popen(
         command,
         stdout=subprocess.PIPE,
         stderr=subprocess.STDOUT,
-        universal_newlines=True,
-    ) as p:
+        start_new_session=True,
+    ) as p, process_group(p.pid):
         assert p.stdout is not None
-        for line in iter(p.stdout.readline, ""):
-            if not suppress_line(line):
-                print_err(name, color, line)
-        if p.wait() < 0:
-            try:
-                signal_name = signal.Signals(-p.returncode).name
-            except (AttributeError, ValueError):
-                signal_name = f"signal {-p.returncode}"
-            print_err(name, color, f"{command[0]} terminated by {signal_name}")
-        return p.returncode
+        fd = p.stdout.fileno()
+        for chunk in iter(lambda: os.read(fd, CHUNK_SIZE), b""):
+            handler.feed(chunk)
+        returncode = p.wait()
+    handler.finish(command, returncode)
+    return returncode
+
+
+async def run_command_async(
+    name: str,
+    color: str,
+    command: Sequence[str],
+    suppress_line: Callable[[str], bool] = lambda line: False,
+    output: Optional[List[str]] = None,
+    echo: bool = True,
+    grouped: bool = False,
+) -> int:
+    """Like run_command, but as a coroutine, so that many commands can
+    be waited on at once without a thread or process for each."""
+    # Coroutines only run once asyncio has been imported by whoever runs
+    # the event loop, so this doesn't slow down importing this module.
+    import asyncio
+
+    handler = OutputHandler(name, color, suppress_line, output, echo, grouped)
+    p = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        start_new_session=True,
+    )
+    assert p.stdout is not None
+    try:
+        with process_group(p.pid):
+            while True:
+                chunk = await p.stdout.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                handler.feed(chunk)
+            returncode = await p.wait()
+    except BaseException:
+        # Reap the terminated command, even if we've been cancelled.
+        await asyncio.shield(p.wait())
+        raise
+    handler.finish(command, returncode)
+    return returncode
+
+
+def split_targets(
+    targets: Sequence[str], shards: int, max_files: Optional[int] = None
+) -> List[List[str]]:
+    """Splits targets into shards batches of roughly equal total file
+    size, or more if needed to keep each batch to at most max_files.
+    Each batch keeps the targets in their original order."""
+    if max_files is not None:
+        shards = max(shards, -(-len(targets) // max_files))
+    shards = max(1, min(shards, len(targets)))
+    if shards == 1:
+        return [list(targets)]
+
+    def size(target: str) -> int:
+        try:
+            return os.path.getsize(target)
+        except OSError:
+            return 0
+
+    sizes = [size(target) for target in targets]
+
+    # Assign the largest files first, each to the smallest batch.
+    batches: List[List[int]] = [[] for _ in range(shards)]
+    heap: List[Tuple[int, int]] = [(0, shard) for shard in range(shards)]
+    for i in sorted(range(len(targets)), key=lambda i: -sizes[i]):
+        total, shard = heapq.heappop(heap)
+        batches[shard].append(i)
+        if max_files is None or len(batches[shard]) < max_files:
+            heapq.heappush(heap, (total + sizes[i], shard))
+    return [[targets[i] for i in sorted(batch)] for batch in batches if batch]
+
+
+async def run_command_batches(
+    name: str,
+    color: str,
+    command: Sequence[str],
+    batches: Sequence[Sequence[str]],
+    jobs: int = 1,
+    suppress_line: Callable[[str], bool] = lambda line: False,
+    output: Optional[List[str]] = None,
+    grouped: bool = False,
+) -> int:
+    """Runs command once with each batch of arguments appended, up to
+    jobs at a time.  Each run's output is printed once it finishes, in
+    the order of the batches, and the first failing return code is
+    returned."""
+    if len(batches) == 1:
+        return await run_command_async(
+            name, color, [*command, *batches[0]], suppress_line, output, grouped=grouped
+        )
+
+    import asyncio
+
+    semaphore = asyncio.Semaphore(jobs)
+
+    async def run_batch(batch: Sequence[str], batch_output: List[str]) -> int:
+        async with semaphore:
+            return await run_command_async(
+                name, color, [*command, *batch], suppress_line, batch_output, echo=False
+            )
+
+    runs = []
+    for batch in batches:
+        batch_output: List[str] = []
+        runs.append(
+            (asyncio.ensure_future(run_batch(batch, batch_output)), batch_output)
+        )
+    returncode = 0
+    for task, batch_output in runs:
+        batch_returncode = await task
+        print_output(name, color, batch_output)
+        if output is not None:
+            output += batch_output
+        if returncode == 0:
+            returncode = batch_returncode
+    return returncode
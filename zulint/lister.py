@@ -1,14 +1,77 @@
 #!/usr/bin/env python3
 
 import argparse
+import ast
+import bisect
+import collections
+import hashlib
+import itertools
 import os
+import posixpath
 import re
+import stat
 import subprocess
 import sys
+import time
 from collections import defaultdict
-from typing import Dict, List, Sequence, Union, overload
+from typing import (
+    AbstractSet,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+    overload,
+)
 
-from typing_extensions import Literal
+# Interpreters that may appear in a shebang line, in order of
+# precedence, and the file type for each.
+SHEBANG_FTYPES = {
+    "python": "py",
+    "sh": "sh",
+    "perl": "pl",
+    "node": "js",
+    "ruby": "rb",
+    "tail": "",  # do not lint these scripts.
+}
+# None of these names contain "s", so findall can't miss an occurrence
+# of one that overlaps an occurrence of another.
+SHEBANG_INTERPRETER_RE = re.compile(r"\bpython|sh|\bperl|\bnode|\bruby|\btail")
+
+REGULAR_FILE_MODES = {"100644", "100755"}
+
+# Shebang lines read by get_ftypes, keyed by git blob SHA.
+shebang_lines: Dict[str, Optional[str]] = {}
+
+
+def read_shebang(fpath: str) -> Optional[str]:
+    """Returns the first line of the file if it is a shebang line, with
+    its line ending normalized to \\n like text mode would."""
+    # opening a file may throw an OSError
+    with open(fpath, "rb") as f:
+        if f.read(2) != b"#!":
+            return None
+        line = ("#!" + f.readline().decode("utf-8")).replace("\r\n", "\n")
+    end = line.find("\r")
+    if end >= 0:
+        line = line[:end] + "\n"
+    return line
+
+
+def get_shebang_ftype(fpath: str, first_line: str) -> Tuple[str, Optional[str]]:
+    """Returns the file type for a shebang line, and an error message
+    if the interpreter is not one we recognize."""
+    interpreters = set(SHEBANG_INTERPRETER_RE.findall(first_line, 2))
+    for interpreter, ftype in SHEBANG_FTYPES.items():
+        if interpreter in interpreters:
+            return ftype, None
+    return "", f'Error: Unknown shebang in file "{fpath}":\n{first_line}'
 
 
 def get_ftype(fpath: str, use_shebang: bool) -> str:
@@ -17,31 +80,512 @@ def get_ftype(fpath: str, use_shebang: bool) -> str:
         return ext[1:]
 
     if use_shebang:
-        # opening a file may throw an OSError
-        with open(fpath, encoding="utf8") as f:
-            first_line = f.readline()
-            if re.search(r"^#!.*\bpython", first_line):
-                return "py"
-            if re.search(r"^#!.*sh", first_line):
-                return "sh"
-            if re.search(r"^#!.*\bperl", first_line):
-                return "pl"
-            if re.search(r"^#!.*\bnode", first_line):
-                return "js"
-            if re.search(r"^#!.*\bruby", first_line):
-                return "rb"
-            if re.search(r"^#!.*\btail", first_line):
-                return ""  # do not lint these scripts.
-            if re.search(r"^#!", first_line):
-                print(
-                    f'Error: Unknown shebang in file "{fpath}":\n{first_line}',
-                    file=sys.stderr,
-                )
-                return ""
+        first_line = read_shebang(fpath)
+        if first_line is not None:
+            ftype, error = get_shebang_ftype(fpath, first_line)
+            if error is not None:
+                print(error, file=sys.stderr)
+            return ftype
 
     return ""
 
 
+def get_ftypes(
+    fpaths: Sequence[str], use_shebang: bool, blob_shas: Mapping[str, str] = {}
+) -> Dict[str, str]:
+    """
+    Determines the types of many files at once, like get_ftype.
+
+    The shebang lines of extensionless files are read concurrently, and
+    cached by git blob SHA for files listed in
+    blob_shas (which must describe the current working tree contents).
+    Errors are printed in the order of fpaths.
+    """
+    ftypes = {}
+    extless_fpaths = []
+    for fpath in fpaths:
+        ext = os.path.splitext(fpath)[1]
+        if ext or not use_shebang:
+            ftypes[fpath] = ext[1:]
+        else:
+            extless_fpaths.append(fpath)
+
+    def get_extless_ftype(fpath: str) -> Tuple[str, Optional[str]]:
+        sha = blob_shas.get(fpath)
+        if sha is not None and sha in shebang_lines:
+            first_line = shebang_lines[sha]
+        else:
+            try:
+                first_line = read_shebang(fpath)
+            except (OSError, UnicodeDecodeError) as e:
+                etype = e.__class__.__name__
+                return (
+                    "",
+                    f'Error: {etype} while determining type of file "{fpath}":\n{e}',
+                )
+            if sha is not None:
+                shebang_lines[sha] = first_line
+        if first_line is None:
+            return "", None
+        return get_shebang_ftype(fpath, first_line)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor() as executor:
+        for fpath, (ftype, error) in zip(
+            extless_fpaths, executor.map(get_extless_ftype, extless_fpaths)
+        ):
+            if error is not None:
+                print(error, file=sys.stderr)
+            ftypes[fpath] = ftype
+    return ftypes
+
+
+class IndexEntry(NamedTuple):
+    path: str
+    mode: str
+    # None if the working tree copy differs from the index.
+    blob_sha: Optional[str]
+
+
+def get_merge_base(since: str) -> str:
+    return (
+        subprocess.check_output(["git", "merge-base", since, "HEAD"])
+        .strip()
+        .decode("utf-8")
+    )
+
+
+def get_changed_files(
+    since: str, targets: Sequence[str] = []
+) -> Tuple[Set[str], List[str]]:
+    """
+    Returns the tracked files changed since the merge base of since and
+    HEAD, whether committed, staged or not, and the untracked files.
+    """
+    merge_base = get_merge_base(since)
+    repository_root = get_repository_root()
+    changed = set()
+    # git diff lists paths relative to the repository root, so convert
+    # them to be relative to the current directory, like git ls-files.
+    for path in subprocess.check_output(
+        ["git", "diff", "--name-only", "-z", merge_base, "--", *targets]
+    ).split(b"\0"):
+        if path:
+            relpath = os.path.relpath(os.path.join(repository_root, path.decode()))
+            changed.add(relpath.replace(os.sep, "/"))
+    untracked = subprocess.check_output(
+        ["git", "ls-files", "-z", "-o", "--exclude-standard", "--", *targets]
+    )
+    return changed, [path.decode() for path in untracked.split(b"\0") if path]
+
+
+HUNK_HEADER_RE = re.compile(rb"^@@ -\d+(?:,\d+)? \+(\d+)(?:,(\d+))? @@")
+
+
+def get_changed_lines(
+    since: Optional[str] = None, targets: Sequence[str] = []
+) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Returns the ranges of lines, numbered from 1 and inclusive, that
+    were added or modified in each changed file since the merge base of
+    since and HEAD, or since HEAD if since is None.  Untracked files are
+    new in their entirety.  Files with no added lines map to [].
+    """
+    base = "HEAD" if since is None else get_merge_base(since)
+    repository_root = get_repository_root()
+    diff = subprocess.check_output(
+        [
+            "git",
+            "diff",
+            "-U0",
+            "--no-color",
+            "--no-ext-diff",
+            "--no-textconv",
+            "--no-prefix",
+            base,
+            "--",
+            *targets,
+        ]
+    )
+    changed_lines: Dict[str, List[Tuple[int, int]]] = {}
+    ranges: Optional[List[Tuple[int, int]]] = None
+    in_header = False
+    for line in diff.split(b"\n"):
+        if line.startswith(b"diff "):
+            in_header = True
+            ranges = None
+        elif in_header and line.startswith(b"+++ "):
+            path = line[4:]
+            # git ends paths containing spaces with a tab.
+            if path.endswith(b"\t"):
+                path = path[:-1]
+            if path == b"/dev/null":
+                continue
+            if path.startswith(b'"'):
+                # git C-quotes unusual paths, escaping non-ASCII bytes.
+                path = ast.literal_eval("b" + path.decode("ascii"))
+            # Like git diff --name-only, this is relative to the root.
+            relpath = os.path.relpath(os.path.join(repository_root, path.decode()))
+            ranges = changed_lines.setdefault(relpath.replace(os.sep, "/"), [])
+        elif line.startswith(b"@@"):
+            in_header = False
+            m = HUNK_HEADER_RE.match(line)
+            if m is not None and ranges is not None:
+                start = int(m.group(1))
+                count = 1 if m.group(2) is None else int(m.group(2))
+                if count > 0:
+                    ranges.append((start, start + count - 1))
+
+    untracked = subprocess.check_output(
+        ["git", "ls-files", "-z", "-o", "--exclude-standard", "--", *targets]
+    )
+    for path in untracked.split(b"\0"):
+        if path:
+            changed_lines[path.decode()] = [(1, sys.maxsize)]
+    return changed_lines
+
+
+class IndexSnapshot:
+    """
+    The regular files that git tracks in the current directory, listed
+    once, so that iter_index can answer from memory for as long as
+    git's index is unchanged.  In a lint run, one is taken the first
+    time the whole index is listed, and then serves every listing,
+    ResultCache's blob SHAs and get_git_path, in this process and the
+    worker processes it forks.
+
+    A long-running process like the daemon passes track_changes, so
+    that working tree changes don't need a new snapshot: each file's
+    size and modification time are checked when it is listed again,
+    and its blob SHA is only trusted if they are unchanged.  Otherwise,
+    the snapshot trusts what git reported when it was taken.
+    """
+
+    # Files modified this close to when the snapshot was taken might
+    # have been modified again without their timestamps changing.
+    RACY_NS = 2 * 10**9
+
+    def __init__(self, track_changes: bool = True) -> None:
+        self.track_changes = track_changes
+        self.directory = os.getcwd()
+        self.root, self.git_dir, index_path = (
+            subprocess.check_output(
+                [
+                    "git",
+                    "rev-parse",
+                    "--show-toplevel",
+                    "--absolute-git-dir",
+                    "--git-path",
+                    "index",
+                ]
+            )
+            .decode("utf-8")
+            .split("\n")[:3]
+        )
+        self.index_path = os.path.abspath(index_path)
+        self.index_stat = self.stat_index()
+        racy_after = time.time_ns() - self.RACY_NS
+        self.paths: List[str] = []
+        self.entries: List[Tuple[str, Optional[str], int, int]] = []
+        for entry in iter_git_index():
+            if not track_changes:
+                self.paths.append(entry.path)
+                self.entries.append((entry.mode, entry.blob_sha, 0, 0))
+                continue
+            try:
+                st = os.lstat(entry.path)
+            except OSError:
+                continue
+            blob_sha = entry.blob_sha if st.st_mtime_ns < racy_after else None
+            self.paths.append(entry.path)
+            self.entries.append((entry.mode, blob_sha, st.st_mtime_ns, st.st_size))
+
+    def stat_index(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.index_path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def is_current(self) -> bool:
+        return self.stat_index() == self.index_stat
+
+    def get_prefix(self) -> Optional[str]:
+        """Returns the path of the current directory relative to the
+        snapshot's, or None if it is outside it."""
+        relpath = os.path.relpath(os.getcwd(), self.directory).replace(os.sep, "/")
+        if relpath == ".":
+            return ""
+        if relpath == ".." or relpath.startswith("../"):
+            return None
+        return relpath
+
+    def get_root_and_prefix(self) -> Optional[Tuple[str, str]]:
+        """Returns what git rev-parse --show-toplevel --show-prefix would."""
+        relpath = os.path.relpath(os.getcwd(), self.root).replace(os.sep, "/")
+        if relpath == ".":
+            return self.root, ""
+        if relpath == ".." or relpath.startswith("../"):
+            return None
+        return self.root, relpath + "/"
+
+    def get_indices(self, targets: Sequence[str], prefix: str) -> Optional[Set[int]]:
+        """Returns the indices in self.paths of the files in targets, or
+        None if a target isn't a plain path within the current directory."""
+        indices = set()
+        for target in targets or ["."]:
+            if target.startswith(":") or any(c in target for c in "*?[\\"):
+                # A pathspec with magic or wildcards.
+                return None
+            path = posixpath.normpath(
+                posixpath.join(prefix, target.replace(os.sep, "/"))
+            )
+            if path == ".":
+                path = ""
+            if path == ".." or path.startswith("../"):
+                # Outside the snapshot's directory.
+                return None
+            if prefix and not (path == prefix or path.startswith(prefix + "/")):
+                return None
+            # self.paths is sorted, so a directory's files are adjacent.
+            i = bisect.bisect_left(self.paths, path)
+            if i < len(self.paths) and self.paths[i] == path:
+                indices.add(i)
+                continue
+            directory = path + "/" if path else ""
+            i = bisect.bisect_left(self.paths, directory)
+            while i < len(self.paths) and self.paths[i].startswith(directory):
+                indices.add(i)
+                i += 1
+        return indices
+
+    def lookup(self, targets: Sequence[str]) -> Optional[List[IndexEntry]]:
+        """Returns what iter_index(targets) would, or None if the snapshot
+        can't tell, e.g. because the index has changed or a target is a
+        glob pattern."""
+        if not self.is_current():
+            return None
+        prefix = self.get_prefix()
+        if prefix is None:
+            return None
+        indices = self.get_indices(targets, prefix)
+        if indices is None:
+            return None
+
+        entries = []
+        start = len(prefix) + 1 if prefix else 0
+        for i in sorted(indices):
+            path = self.paths[i][start:]
+            mode, blob_sha, mtime_ns, size = self.entries[i]
+            if self.track_changes:
+                try:
+                    st = os.lstat(path)
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                if (st.st_mtime_ns, st.st_size) != (mtime_ns, size):
+                    blob_sha = None
+            entries.append(IndexEntry(path, mode, blob_sha))
+        return entries
+
+
+# Set by the daemon to serve listings from memory.
+index_snapshot: Optional[IndexSnapshot] = None
+# Set by LinterConfig, so that a snapshot is taken the first time the
+# whole index is listed; listing only modified files doesn't need one.
+take_index_snapshot = False
+
+
+def get_index_snapshot() -> Optional[IndexSnapshot]:
+    global index_snapshot  # noqa: PLW0603
+    if index_snapshot is None and take_index_snapshot:
+        index_snapshot = IndexSnapshot(track_changes=False)
+    return index_snapshot
+
+
+def get_repository_root() -> str:
+    root_and_prefix = (
+        None if index_snapshot is None else index_snapshot.get_root_and_prefix()
+    )
+    if root_and_prefix is not None:
+        return root_and_prefix[0]
+    return (
+        subprocess.check_output(["git", "rev-parse", "--show-toplevel"])
+        .strip()
+        .decode("utf-8")
+    )
+
+
+def get_git_path(name: str) -> str:
+    """Returns the absolute path of name within the .git directory, like
+    git rev-parse --git-path."""
+    if index_snapshot is not None:
+        return os.path.join(index_snapshot.git_dir, name)
+    git_path = (
+        subprocess.check_output(["git", "rev-parse", "--git-path", name])
+        .strip()
+        .decode("utf-8")
+    )
+    return os.path.abspath(git_path)
+
+
+def iter_index(
+    targets: Sequence[str] = [],
+    modified_only: bool = False,
+    since: Optional[str] = None,
+) -> Iterator[IndexEntry]:
+    """
+    Streams the regular files tracked by git, as git ls-files lists
+    them.  Symlinks (mode 120000), submodules (mode 160000) and files
+    deleted from the working tree are skipped, using what git reports
+    rather than a stat call per file.
+
+    If since is given, only files changed since the merge base of since
+    and HEAD are listed, followed by any untracked files.
+    """
+    if not modified_only and since is None:
+        snapshot = get_index_snapshot()
+        entries = None if snapshot is None else snapshot.lookup(targets)
+        if entries is not None:
+            return iter(entries)
+    return iter_git_index(targets, modified_only, since)
+
+
+def read_index_entries(cmdline: List[str]) -> Iterator[Tuple[str, str, str, str, str]]:
+    """Streams the path, tag, mode, blob SHA and stage of each entry that
+    git ls-files -z -s -t lists."""
+    with subprocess.Popen(cmdline, stdout=subprocess.PIPE) as p:
+        assert p.stdout is not None
+        stdout = p.stdout
+        remainder = b""
+        for chunk in iter(lambda: stdout.read(65536), b""):
+            entries = (remainder + chunk).split(b"\0")
+            remainder = entries.pop()
+            for entry in entries:
+                info, path = entry.split(b"\t", 1)
+                tag, mode, blob_sha, stage = info.decode().split(" ")
+                yield path.decode(), tag, mode, blob_sha, stage
+    if p.returncode != 0:
+        raise subprocess.CalledProcessError(p.returncode, cmdline)
+
+
+def iter_git_index(
+    targets: Sequence[str] = [],
+    modified_only: bool = False,
+    since: Optional[str] = None,
+) -> Iterator[IndexEntry]:
+    changed: Optional[Set[str]] = None
+    untracked: List[str] = []
+    if since is not None:
+        changed, untracked = get_changed_files(since, targets)
+    # git lists modified and deleted files separately from the index
+    # entries, tagged C and R; deleted files are also listed as modified.
+    tags: Dict[str, Set[str]] = collections.defaultdict(set)
+    for entry in subprocess.check_output(
+        ["git", "ls-files", "-z", "-t", "-m", "-d", "--", *targets]
+    ).split(b"\0")[:-1]:
+        change_tag, changed_path = entry.split(b" ", 1)
+        tags[changed_path.decode()].add(change_tag.decode())
+
+    if modified_only:
+        # Only the modified files' entries are needed, which are usually
+        # far fewer than the whole index; they're passed as pathspecs in
+        # batches to stay within the limits on command line length.
+        paths = [
+            path
+            for path, path_tags in tags.items()
+            if "R" not in path_tags and (changed is None or path in changed)
+        ]
+        cmdlines = [
+            ["git", "--literal-pathspecs", "ls-files", "-z", "-s", "-t", "--"]
+            + paths[i : i + 1000]
+            for i in range(0, len(paths), 1000)
+        ]
+    else:
+        cmdlines = [["git", "ls-files", "-z", "-s", "-t", "--", *targets]]
+
+    for cmdline in cmdlines:
+        # The index is sorted by path, so the stages of an unmerged
+        # file are listed together.
+        for path, group in itertools.groupby(
+            read_index_entries(cmdline), lambda e: e[0]
+        ):
+            _, tag, mode, blob_sha, stage = next(group)
+            path_tags = tags.get(path, set())
+            if tag == "S":
+                # Skipped by a sparse checkout, so not in the working tree.
+                continue
+            # Unmerged; the working tree matches no stage.
+            modified = "C" in path_tags or stage != "0"
+            if (modified_only and not modified) or (
+                changed is not None and path not in changed
+            ):
+                continue
+            if mode in REGULAR_FILE_MODES and "R" not in path_tags:
+                yield IndexEntry(path, mode, None if modified else blob_sha)
+
+    if not modified_only:
+        for path in untracked:
+            if not os.path.islink(path) and os.path.isfile(path):
+                yield IndexEntry(path, "100644", None)
+
+
+def get_blob_shas() -> Dict[str, str]:
+    """
+    Returns the git blob SHA of every tracked file in the current
+    directory, keyed by path.  Files whose working tree contents differ
+    from the index are left out; use hash_blob for those.
+    """
+    return {
+        entry.path: entry.blob_sha
+        for entry in iter_index()
+        if entry.blob_sha is not None
+    }
+
+
+def hash_blob(fpath: str) -> str:
+    """Computes the git blob SHA of a file's contents, like git hash-object."""
+    with open(fpath, "rb") as f:
+        contents = f.read()
+    # SHA-1 here is git's object name format, not a security measure.
+    return hashlib.sha1(b"blob %d\0" % len(contents) + contents).hexdigest()  # noqa: S324
+
+
+def get_excluded_paths(repository_root: str, exclude: Sequence[str]) -> Set[str]:
+    """
+    Normalizes exclusions to paths relative to the repository root, so
+    that checking a file only takes a set lookup for each of its parent
+    directories.  The root itself is represented by "".
+    """
+    excluded_paths = set()
+    for fpath in exclude:
+        relpath = os.path.relpath(
+            os.path.abspath(os.path.join(repository_root, fpath)), repository_root
+        ).replace(os.sep, "/")
+        if relpath == ".":
+            excluded_paths.add("")
+        elif not relpath.startswith("../"):
+            excluded_paths.add(relpath)
+    return excluded_paths
+
+
+def is_excluded(relpath: str, excluded_paths: AbstractSet[str]) -> bool:
+    """Checks whether a path relative to the repository root, or any of
+    its parent directories, is in excluded_paths."""
+    if relpath.startswith("../") or "/../" in relpath:
+        relpath = posixpath.normpath(relpath)
+    if "" in excluded_paths or relpath in excluded_paths:
+        return True
+    i = relpath.find("/")
+    while i >= 0:
+        if relpath[:i] in excluded_paths:
+            return True
+        i = relpath.find("/", i + 1)
+    return False
+
+
 @overload
 def list_files(
     group_by_ftype: Literal[False] = False,
@@ -51,6 +595,7 @@ def list_files(
     modified_only: bool = False,
     exclude: Sequence[str] = [],
     extless_only: bool = False,
+    since: Optional[str] = None,
 ) -> List[str]:
     ...
 
@@ -64,6 +609,7 @@ def list_files(
     modified_only: bool = False,
     exclude: Sequence[str] = [],
     extless_only: bool = False,
+    since: Optional[str] = None,
 ) -> Dict[str, List[str]]:
     ...
 
@@ -76,6 +622,7 @@ def list_files(
     modified_only: bool = False,
     exclude: Sequence[str] = [],
     extless_only: bool = False,
+    since: Optional[str] = None,
 ) -> Union[Dict[str, List[str]], List[str]]:
     """
     List files tracked by git.
@@ -92,68 +639,22 @@ def list_files(
     group_by_ftype - If True, returns a dict of lists keyed by file type.
         If False, returns a flat list of files.
     extless_only - Only include extensionless files in output.
+    since - Only include files changed since the merge base of this git ref and
+        HEAD, including staged, unstaged and untracked changes.
     """
-    ftypes = [x.strip(".") for x in ftypes]
-    ftypes_set = set(ftypes)
-
-    # Really this is all bytes -- it's a file path -- but we get paths in
-    # sys.argv as str, so that battle is already lost.  Settle for hoping
-    # everything is UTF-8.
-    repository_root = (
-        subprocess.check_output(["git", "rev-parse", "--show-toplevel"])
-        .strip()
-        .decode("utf-8")
-    )
-    exclude_abspaths = [
-        os.path.abspath(os.path.join(repository_root, fpath)) for fpath in exclude
-    ]
-
-    cmdline = [
-        "git",
-        "ls-files",
-        "-z",
-        *(["-m"] if modified_only else []),
-        "--",
-        *targets,
-    ]
-
-    files = [f.decode() for f in subprocess.check_output(cmdline).split(b"\0")]
-    assert files.pop() == ""
-    # throw away non-files (like symlinks)
-    files = [f for f in files if not os.path.islink(f) and os.path.isfile(f)]
-
     result_dict: Dict[str, List[str]] = defaultdict(list)
     result_list: List[str] = []
 
-    for fpath in files:
-        # this will take a long time if exclude is very large
-        ext = os.path.splitext(fpath)[1]
-        if extless_only and ext:
-            continue
-        absfpath = os.path.abspath(fpath)
-        if any(
-            absfpath == expath or absfpath.startswith(os.path.abspath(expath) + os.sep)
-            for expath in exclude_abspaths
-        ):
-            continue
-
-        if not ftypes and not group_by_ftype:
-            result_list.append(fpath)
-            continue
-
-        try:
-            filetype = get_ftype(fpath, use_shebang)
-        except (OSError, UnicodeDecodeError) as e:
-            etype = e.__class__.__name__
-            print(
-                f'Error: {etype} while determining type of file "{fpath}":',
-                file=sys.stderr,
-            )
-            print(e, file=sys.stderr)
-            filetype = ""
-        if ftypes and filetype not in ftypes_set:
-            continue
-
+    for fpath, filetype in iter_files(
+        targets=targets,
+        ftypes=ftypes,
+        use_shebang=use_shebang,
+        modified_only=modified_only,
+        exclude=exclude,
+        extless_only=extless_only,
+        since=since,
+        with_ftypes=group_by_ftype,
+    ):
         if group_by_ftype:
             result_dict[filetype].append(fpath)
         else:
@@ -164,6 +665,71 @@ def list_files(
     return result_list
 
 
+def iter_files(
+    targets: Sequence[str] = [],
+    ftypes: Sequence[str] = [],
+    use_shebang: bool = True,
+    modified_only: bool = False,
+    exclude: Sequence[str] = [],
+    extless_only: bool = False,
+    since: Optional[str] = None,
+    with_ftypes: bool = False,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Like list_files, but yields (path, file type) pairs as git lists
+    the files, rather than building the whole list first.  File types
+    are only determined (and otherwise "") if with_ftypes is True or
+    ftypes is non-empty.
+    """
+    ftypes = [x.strip(".") for x in ftypes]
+    ftypes_set = set(ftypes)
+    with_ftypes = with_ftypes or bool(ftypes)
+
+    # Really this is all bytes -- it's a file path -- but we get paths in
+    # sys.argv as str, so that battle is already lost.  Settle for hoping
+    # everything is UTF-8.
+    root_and_prefix = (
+        None if index_snapshot is None else index_snapshot.get_root_and_prefix()
+    )
+    if root_and_prefix is None:
+        repository_root, prefix = (
+            subprocess.check_output(
+                ["git", "rev-parse", "--show-toplevel", "--show-prefix"]
+            )
+            .decode("utf-8")
+            .split("\n")[:2]
+        )
+    else:
+        repository_root, prefix = root_and_prefix
+    excluded_paths = get_excluded_paths(repository_root, exclude)
+
+    entries = (
+        entry
+        for entry in iter_index(targets, modified_only, since)
+        if not (extless_only and os.path.splitext(entry.path)[1])
+        and not (excluded_paths and is_excluded(prefix + entry.path, excluded_paths))
+    )
+    if not with_ftypes:
+        for entry in entries:
+            yield entry.path, ""
+        return
+
+    # Determine file types in batches, so that get_ftypes can read
+    # shebang lines concurrently without giving up streaming.
+    while True:
+        batch = list(itertools.islice(entries, 1024))
+        if not batch:
+            break
+        blob_shas = {
+            entry.path: entry.blob_sha for entry in batch if entry.blob_sha is not None
+        }
+        filetypes = get_ftypes([entry.path for entry in batch], use_shebang, blob_shas)
+        for entry in batch:
+            filetype = filetypes[entry.path]
+            if not ftypes or filetype in ftypes_set:
+                yield entry.path, filetype
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="List files tracked by git and optionally filter by type"
@@ -210,6 +776,11 @@ if __name__ == "__main__":
         default=False,
         help="only include extensionless files in output",
     )
+    parser.add_argument(
+        "--since",
+        metavar="REF",
+        help="list only files changed since the merge base of REF and HEAD",
+    )
     args = parser.parse_args()
     listing = list_files(
         targets=args.targets,
@@ -218,6 +789,7 @@ if __name__ == "__main__":
         modified_only=args.modified,
         exclude=args.exclude,
         extless_only=args.extless_only,
+        since=args.since,
     )
     for path in listing:
         print(path)
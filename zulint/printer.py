@@ -1,4 +1,10 @@
+import codecs
+import io
+import sys
 from itertools import cycle
+from typing import Iterable, List, TextIO
+
+from zulint import results
 
 # Terminal Color codes for use in differentiatng linters
 BOLDRED = "\x1B[1;31m"
@@ -12,15 +18,80 @@ ENDC = "\033[0m"
 colors = cycle([GREEN, YELLOW, BLUE, MAGENTA, CYAN])
 
 
-def print_err(name: str, color: str, line: str) -> None:
-    print(
-        "{color}{name}{pad}|{end} {red_color}{line!s}{end}".format(
-            color=color,
-            name=name,
-            pad=" " * max(0, 10 - len(name)),
-            red_color=BOLDRED,
-            line=line.rstrip(),
-            end=ENDC,
-        ),
-        flush=True,
+def format_lines(name: str, color: str, lines: Iterable[str]) -> str:
+    prefix = "{color}{name}{pad}|{end} {red_color}".format(
+        color=color,
+        name=name,
+        pad=" " * max(0, 10 - len(name)),
+        red_color=BOLDRED,
+        end=ENDC,
     )
+    return "".join(f"{prefix}{line.rstrip()}{ENDC}\n" for line in lines)
+
+
+def text_stream() -> TextIO:
+    """Returns where human-readable output goes: stdout, unless that is
+    where structured results are being written."""
+    return sys.stderr if results.writes_to_stdout() else sys.stdout
+
+
+def print_lines(name: str, color: str, lines: Iterable[str]) -> None:
+    """Prints lines of a linter's output as one block, so that they
+    aren't interleaved with output from other processes."""
+    block = format_lines(name, color, lines)
+    if block:
+        stream = text_stream()
+        stream.write(block)
+        stream.flush()
+
+
+def print_output(name: str, color: str, lines: List[str]) -> None:
+    """Prints lines that an external linter output, and reports them as
+    structured results."""
+    print_lines(name, color, lines)
+    results.report_output(name, lines)
+
+
+def print_err(name: str, color: str, line: str) -> None:
+    print_lines(name, color, [line])
+
+
+class LineDecoder:
+    """Decodes chunks of a subprocess's output into lines, translating
+    newlines like a file opened in text mode."""
+
+    def __init__(self, encoding: str) -> None:
+        self.decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(encoding)("replace"), translate=True
+        )
+        self.partial_line = ""
+
+    def decode(self, data: bytes, final: bool = False) -> List[str]:
+        lines = (self.partial_line + self.decoder.decode(data, final)).split("\n")
+        self.partial_line = lines.pop()
+        decoded = [line + "\n" for line in lines]
+        if final and self.partial_line:
+            decoded.append(self.partial_line)
+            self.partial_line = ""
+        return decoded
+
+
+class BlockPrinter:
+    """Prints a linter's output in blocks: each batch of lines as it
+    arrives, or, if grouped, all of it at once when closed."""
+
+    def __init__(self, name: str, color: str, grouped: bool = False) -> None:
+        self.name = name
+        self.color = color
+        self.grouped = grouped
+        self.lines: List[str] = []
+
+    def write(self, lines: Iterable[str]) -> None:
+        if self.grouped:
+            self.lines += lines
+        else:
+            print_output(self.name, self.color, list(lines))
+
+    def close(self) -> None:
+        print_output(self.name, self.color, self.lines)
+        self.lines = []
@@ -0,0 +1,218 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, Iterable, Iterator, Optional
+
+FORMATS = ["text", "json", "sarif", "github"]
+
+# The "path:line[:column]: message" format that most linters print.
+LOCATION_RE = re.compile(
+    r"^(?P<path>[^\s:][^:]*):(?P<line>\d+)(?::(?P<column>\d+))?:\s*(?P<message>.*)"
+)
+ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+
+def escape_github_data(value: str) -> str:
+    return value.replace("%", "%25").replace("\r", "%0D").replace("\n", "%0A")
+
+
+def escape_github_property(value: str) -> str:
+    return escape_github_data(value).replace(":", "%3A").replace(",", "%2C")
+
+
+class ResultWriter:
+    """Streams structured results to path, or to stdout if path is None.
+
+    Each record is written with a single os.write on a descriptor
+    opened for appending, so the linter processes forked from this one
+    can report results concurrently.  For SARIF, which is one JSON
+    document, records are spooled to a temporary file, and written out
+    by close().
+    """
+
+    def __init__(self, format: str, path: Optional[str] = None) -> None:
+        assert format in FORMATS and format != "text"
+        self.format = format
+        self.path = path
+        if path is None:
+            self.fd = os.dup(1)
+        else:
+            self.fd = os.open(
+                path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o666
+            )
+        self.spool_fd: Optional[int] = None
+        if format == "sarif":
+            import tempfile
+
+            spool_fd, spool_path = tempfile.mkstemp(prefix="zulint-", suffix=".jsonl")
+            os.close(spool_fd)
+            self.spool_fd = os.open(spool_path, os.O_RDWR | os.O_APPEND)
+            os.unlink(spool_path)
+
+    def write(self, record: Dict[str, object]) -> None:
+        if self.format == "json":
+            os.write(self.fd, (json.dumps(record) + "\n").encode("utf-8"))
+        elif self.format == "github":
+            if record["type"] == "finding" and record["path"] is not None:
+                properties = "file=" + escape_github_property(str(record["path"]))
+                if record["line"] is not None:
+                    properties += ",line={}".format(record["line"])
+                command = "::error {},title={}::{}\n".format(
+                    properties,
+                    escape_github_property(str(record["linter"])),
+                    escape_github_data(str(record["message"])),
+                )
+                os.write(self.fd, command.encode("utf-8"))
+        else:
+            assert self.spool_fd is not None
+            os.write(self.spool_fd, (json.dumps(record) + "\n").encode("utf-8"))
+
+    def spooled_records(self) -> Iterator[Dict[str, object]]:
+        assert self.spool_fd is not None
+        os.lseek(self.spool_fd, 0, os.SEEK_SET)
+        with open(os.dup(self.spool_fd), encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def write_sarif(self) -> None:
+        with open(os.dup(self.fd), "w", encoding="utf-8") as f:
+            f.write(
+                '{"version": "2.1.0", "$schema": %s, "runs": [{"tool": {"driver": '
+                '{"name": "zulint", "informationUri": '
+                '"https://github.com/zulip/zulint"}}, "results": [\n'
+                % json.dumps(SARIF_SCHEMA)
+            )
+            separator = ""
+            timings: Dict[str, float] = {}
+            successful = True
+            for record in self.spooled_records():
+                if record["type"] == "timing":
+                    seconds = record["seconds"]
+                    assert isinstance(seconds, (int, float))
+                    timings[str(record["linter"])] = seconds
+                    successful = successful and record["returncode"] == 0
+                    continue
+                if record["type"] != "finding":
+                    continue
+                result: Dict[str, object] = {
+                    "ruleId": record["linter"],
+                    "level": "error",
+                    "message": {"text": record["message"]},
+                }
+                if record["path"] is not None:
+                    region = {"startLine": record["line"]} if record["line"] else {}
+                    result["locations"] = [
+                        {
+                            "physicalLocation": {
+                                "artifactLocation": {"uri": record["path"]},
+                                "region": region,
+                            }
+                        }
+                    ]
+                f.write(separator + json.dumps(result))
+                separator = ",\n"
+            invocation = {
+                "executionSuccessful": successful,
+                "properties": {"timings": timings},
+            }
+            f.write('\n], "invocations": [%s]}]}\n' % json.dumps(invocation))
+
+    def close(self) -> None:
+        if self.spool_fd is not None:
+            self.write_sarif()
+            os.close(self.spool_fd)
+        os.close(self.fd)
+
+
+writer: Optional[ResultWriter] = None
+# The linter that the current thread is running, for records reported
+# without naming one, like those from RuleList.check.
+local = threading.local()
+
+
+def open_results(format: str, path: Optional[str] = None) -> None:
+    global writer  # noqa: PLW0603
+    if format != "text":
+        writer = ResultWriter(format, path)
+
+
+def close_results() -> None:
+    global writer  # noqa: PLW0603
+    if writer is not None:
+        writer.close()
+        writer = None
+
+
+def writes_to_stdout() -> bool:
+    return writer is not None and writer.path is None
+
+
+def set_current_linter(name: Optional[str]) -> None:
+    local.linter = name
+
+
+def current_linter() -> Optional[str]:
+    return getattr(local, "linter", None)
+
+
+def report_finding(
+    linter: str,
+    path: Optional[str],
+    line: Optional[int],
+    message: str,
+    **details: object,
+) -> None:
+    if writer is not None:
+        writer.write(
+            {
+                "type": "finding",
+                "linter": linter,
+                "path": path,
+                "line": line,
+                "message": message,
+                **details,
+            }
+        )
+
+
+def report_output(linter: str, lines: Iterable[str]) -> None:
+    """Reports lines that a linter printed: those that mention a file and
+    line number as findings, and the rest, like summaries, as output."""
+    if writer is None:
+        return
+    for line in lines:
+        text = ANSI_ESCAPE_RE.sub("", line).rstrip()
+        if not text:
+            continue
+        m = LOCATION_RE.match(text)
+        if m is None:
+            writer.write({"type": "output", "linter": linter, "message": text})
+        else:
+            column = m.group("column")
+            report_finding(
+                linter,
+                m.group("path"),
+                int(m.group("line")),
+                m.group("message"),
+                column=None if column is None else int(column),
+            )
+
+
+def report_profile(linter: str, **details: object) -> None:
+    if writer is not None:
+        writer.write({"type": "profile", "linter": linter, **details})
+
+
+def report_timing(linter: str, seconds: float, returncode: int) -> None:
+    if writer is not None:
+        writer.write(
+            {
+                "type": "timing",
+                "linter": linter,
+                "seconds": seconds,
+                "returncode": returncode,
+            }
+        )